@@ -1,33 +1,80 @@
 import os
+import glob
 import sqlite3
 import traceback
+import contextlib
 
 class GeneralDB:
     ''' basic sqlite3 db which can be used for many purposes
         this isnt very safe probably but i dont really care'''
 
-    def __init__(self, sessionName):
+    def __init__(self, sessionName, persistent=False):
         self.connection = None
         self.cursor = None
 
         self.sessionName = sessionName # unique String to each instance of this object (The DB name, not the table name)
+        self.persistent = persistent # keep one connection open (in WAL mode) instead of reconnecting for every call
+        self.transactionDepth = 0 # how many transaction() blocks we are inside of
 
     def initCursor(self):
         ''' create and set the cursor'''
         os.makedirs("DBSessions", exist_ok=True)
-        self.connection = sqlite3.connect("DBSessions/"+self.sessionName+".db")
+        # parameterized statements get compiled once and reused from this cache
+        # the connection may be opened on the main thread and used on the writer thread afterwards (see BB.writer),
+        # thats fine as long as only one thread uses it at a time, which the single writer thread makes sure of
+        self.connection = sqlite3.connect("DBSessions/"+self.sessionName+".db", cached_statements=256, check_same_thread=False)
         self.cursor = self.connection.cursor()
+        if self.persistent:
+            self.cursor.execute("pragma journal_mode=WAL")
+            self.cursor.execute("pragma synchronous=NORMAL")
+            self.cursor.execute("pragma temp_store=MEMORY")
 
     def closeCursor(self, save=True):
-        ''' close the connection and maybe save the changes'''
+        ''' close the connection and maybe save the changes
+        inside a transaction() this does nothing, the transaction commits once at the end
+        in persistent mode the connection stays open after saving'''
         if self.connection is None:
             return
+        if self.transactionDepth > 0:
+            return
         if save:
             self.connection.commit()
+        if self.persistent:
+            return
+        self.connection.close()
+        self.connection = None
+        self.cursor = None
+
+    def close(self):
+        ''' save and really close the connection, even in persistent mode'''
+        if self.connection is None:
+            return
+        self.connection.commit()
         self.connection.close()
         self.connection = None
         self.cursor = None
 
+    @contextlib.contextmanager
+    def transaction(self):
+        ''' group every call inside the block into a single commit
+        with db.transaction():
+            db.emptyTable("messages")
+            db.addRows("messages", rows)
+        if something raises inside the block, everything in it is rolled back'''
+        self.checkCursor()
+        self.transactionDepth += 1
+        try:
+            yield self
+        except:
+            self.transactionDepth -= 1
+            if self.transactionDepth == 0:
+                self.connection.rollback()
+                self.closeCursor(save=False)
+            raise
+        self.transactionDepth -= 1
+        if self.transactionDepth == 0:
+            self.closeCursor()
+
     def checkCursor(self):
         ''' shorten the cursor init even more'''
         if self.connection is None:
@@ -57,11 +104,41 @@ class GeneralDB:
         self.closeCursor()
         return g
 
+    def execute(self, statement, parameters=()):
+        ''' execute a parameterized statement that doesnt return anything'''
+        self.checkCursor()
+        try:
+            self.cursor.execute(statement, parameters)
+        except:
+            traceback.print_exc()
+        self.closeCursor()
+
+    def executeMany(self, statement, rows):
+        ''' execute a parameterized statement once for every row of parameters'''
+        self.checkCursor()
+        try:
+            self.cursor.executemany(statement, rows)
+        except:
+            traceback.print_exc()
+        self.closeCursor()
+
+    def query(self, statement, parameters=()):
+        ''' execute a parameterized select statement and return all the rows (or None if it failed)'''
+        self.checkCursor()
+        try:
+            self.cursor.execute(statement, parameters)
+            output = self.cursor.fetchall()
+        except:
+            traceback.print_exc()
+            output = None
+        self.closeCursor()
+        return output
+
     def getItem(self, table, column, rowID):
         ''' get a specific item from a table given a row ID and a column'''
         self.checkCursor()
         try:
-            self.cursor.execute("select ? from {} where id=?".format(table), (column, rowID,))
+            self.cursor.execute("select {} from {} where id=?".format(column, table), (rowID,))
             output = self.cursor.fetchone()
         except:
             traceback.print_exc()
@@ -110,7 +187,7 @@ class GeneralDB:
         ''' make a new row in a table with the given list of values'''
         self.checkCursor()
         try:
-            self.cursor.execute("insert into {} values ({})".format(table, ",".join(values)))
+            self.cursor.execute(f"insert into {table} values ({','.join(['?' for _ in values])})", values)
         except:
             traceback.print_exc()
         self.closeCursor()
@@ -157,13 +234,9 @@ class GeneralDB:
     def replaceRow(self, table, rowID, newRowValues):
         ''' edit a row in a table to replace all of its values with new info
         newRowValues should be a list of new values not including the row ID'''
-        self.checkCursor()
-        try:
+        with self.transaction():
             self.delRow(table, rowID)
-            self.addRow(table, ['"'+rowID+'"']+newRowValues)
-        except:
-            traceback.print_exc()
-        self.closeCursor()
+            self.addRow(table, [rowID]+newRowValues)
 
     def createTable(self, name, columns, suppress=False):
         ''' make a new table with these column names'''
@@ -181,8 +254,8 @@ class GeneralDB:
         ''' check to see if a table exists and return true or false'''
         self.checkCursor()
         try:
-            self.cursor.execute("select * from {}".format(table))
-            output = True
+            self.cursor.execute("select 1 from sqlite_master where type='table' and name=?", (table,))
+            output = self.cursor.fetchone() is not None
         except:
             output = False
         self.closeCursor()
@@ -197,10 +270,71 @@ class GeneralDB:
         self.checkCursor()
         for rowID in rowIDs:
             try:
-                self.cursor.execute("select * from {} where id = {}".format(table, rowID))
-                if len(self.cursor.fetchone()) == 0:
+                self.cursor.execute("select * from {} where id = ?".format(table), (rowID,))
+                if self.cursor.fetchone() is None:
                     missingRows.append(rowID)
             except:
                 missingRows.append(rowID)
         self.closeCursor()
         return missingRows
+
+
+class MessageStore:
+    ''' the live stream messages of every guild in one database (DBSessions/messages.db)
+    rows are keyed by (guild id, user id) and the user id is indexed too, so a guild or a user
+    is a single indexed lookup. the rows handed around look like (message id, login, user id, fingerprint)'''
+
+    def __init__(self, sessionName="messages"):
+        self.db = GeneralDB(sessionName, persistent=True)
+        self.db.execute("create table if not exists messages ("
+            "guild_id text not null, message_id text, streamer text, user_id text not null, fingerprint text, "
+            "primary key (guild_id, user_id))")
+        self.db.execute("create index if not exists messages_by_user on messages (user_id)")
+
+    def getGuild(self, guild_id):
+        ''' return a dict mapping user ids to the message rows of a guild'''
+        rows = self.db.query("select message_id, streamer, user_id, fingerprint from messages where guild_id=?", (str(guild_id),))
+        return {row[2]: row for row in rows or []}
+
+    def getUser(self, user_id):
+        ''' return a list of (guild id, message row) for every message of a streamer in every guild'''
+        rows = self.db.query("select guild_id, message_id, streamer, user_id, fingerprint from messages where user_id=?", (str(user_id),))
+        return [(row[0], row[1:]) for row in rows or []]
+
+    def applyChanges(self, guild_id, changed, removed):
+        ''' insert or overwrite the changed message rows of a guild and delete the rows of the removed user ids, in a single commit'''
+        with self.db.transaction():
+            if len(removed) > 0:
+                self.db.executeMany("delete from messages where guild_id=? and user_id=?", [(str(guild_id), str(x)) for x in removed])
+            if len(changed) > 0:
+                self.db.executeMany("insert or replace into messages values (?,?,?,?,?)", [(str(guild_id),)+tuple(row) for row in changed])
+
+    def emptyGuild(self, guild_id):
+        ''' forget every message of a guild and return the rows that were stored'''
+        with self.db.transaction():
+            rows = self.getGuild(guild_id)
+            self.db.execute("delete from messages where guild_id=?", (str(guild_id),))
+        return list(rows.values())
+
+    def migrate(self, folder="DBSessions"):
+        ''' move the rows out of the old one-file-per-guild databases (DBSessions/live_<guild id>.db)
+        each old file is renamed to .migrated afterwards so this only happens once'''
+        paths = glob.glob(os.path.join(folder, "live_*.db"))
+        if len(paths) == 0:
+            return 0
+        migrated = 0
+        with self.db.transaction():
+            for path in paths:
+                guild_id = os.path.basename(path)[len("live_"):-len(".db")]
+                old = GeneralDB("live_"+guild_id)
+                rows = old.getTable("messages") if old.verifyTableExists("messages") else []
+                old.close()
+                # old files may be from before the fingerprint column existed
+                rows = [(guild_id,)+tuple(row)+(None,)*(4-len(row)) for row in rows or []]
+                if len(rows) > 0:
+                    self.db.executeMany("insert or replace into messages values (?,?,?,?,?)", rows)
+                migrated += 1
+        for path in paths:
+            os.replace(path, path+".migrated")
+        print(f"Moved the messages of {migrated} guilds into {self.db.sessionName}.db")
+        return migrated
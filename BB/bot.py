@@ -13,6 +13,7 @@ from discord.ext import commands
 from BB.conf import Conf
 from BB.permissions import *
 from BB.live import LiveCheck
+from BB.settings import flush_all
 
 
 class Barry(discord.Client):
@@ -61,6 +62,7 @@ class Main(commands.Cog):
     @commands.check(Perms.is_owner)
     async def shutdown(self, ctx):
         await ctx.send("Shutting down. I will not restart until manually run again.")
+        flush_all()
         await self.BarryBot.logout()
         await self.bot.logout()
 
@@ -0,0 +1,89 @@
+import asyncio
+import traceback
+
+from BB.DB import GeneralDB
+
+
+class GameCatalog:
+    '''
+    A two way map of game ids and game names, saved in DBSessions/games.db and loaded on startup.
+    Category ids basically never change, so once we know one there is no reason to ask Twitch again.
+    Only names or ids we have never seen get requested.
+    Names/ids Twitch didn't know about are remembered too, until the next revalidation, so they dont get requested every loop.
+    Every so often the whole catalog is requested again in the background in case something was renamed.
+    With a writer (see BB.writer.DBWriter) saving happens on the writer thread.
+    '''
+    def __init__(self, fetch_by_names, fetch_by_ids, revalidate_every=86400, writer=None):
+        self.fetch_by_names = fetch_by_names    # coroutine, list of names -> dict of names to ids
+        self.fetch_by_ids = fetch_by_ids        # coroutine, list of ids -> dict of ids to names
+        self.revalidate_every = revalidate_every
+        self.writer = writer
+
+        self.ids = {}               # game id -> game name
+        self.names = {}             # game name -> game id
+        self.missing = set()        # names and ids twitch gave nothing back for
+
+        self.db = GeneralDB("games", persistent=True)
+        if not self.db.verifyTableExists("games"):
+            self.db.createTable("games", ["id text", "name text"])
+        for row in self.db.getTable("games") or []:
+            self.ids[row[0]] = row[1]
+            self.names[row[1]] = row[0]
+
+    async def remember(self, id_to_name):
+        '''put new or renamed games in the catalog and save them'''
+        changed = []
+        for game_id, name in id_to_name.items():
+            old_name = self.ids.get(game_id)
+            if old_name == name:
+                continue
+            if old_name is not None:
+                self.names.pop(old_name, None)
+            self.ids[game_id] = name
+            self.names[name] = game_id
+            changed.append((game_id, name))
+        if len(changed) == 0:
+            return
+        if self.writer is None:
+            return self.save(changed)
+        await self.writer.run("games", self.save, changed)
+
+    def save(self, changed):
+        '''write new or renamed games to the database, in a single commit'''
+        with self.db.transaction():
+            for game_id, name in changed:
+                self.db.delRow("games", game_id)
+            self.db.addRows("games", changed)
+
+    async def ids_for_names(self, game_names):
+        '''return a dict mapping the given names to ids, only requesting names never seen before'''
+        unknown = [x for x in game_names if x not in self.names and x not in self.missing]
+        if len(unknown) > 0:
+            found = await self.fetch_by_names(unknown)
+            await self.remember({v: k for k, v in found.items()})
+            self.missing |= {x for x in unknown if x not in found}
+        return {x: self.names[x] for x in game_names if x in self.names}
+
+    async def names_for_ids(self, game_ids):
+        '''return a dict mapping the given ids to names, only requesting ids never seen before'''
+        unknown = [x for x in game_ids if x not in self.ids and x not in self.missing]
+        if len(unknown) > 0:
+            found = await self.fetch_by_ids(unknown)
+            await self.remember(found)
+            self.missing |= {x for x in unknown if x not in found}
+        return {x: self.ids[x] for x in game_ids if x in self.ids}
+
+    async def revalidate(self):
+        '''request every known game again to pick up renames, and give missing names/ids another chance'''
+        self.missing = set()
+        if len(self.ids) > 0:
+            await self.remember(await self.fetch_by_ids(list(self.ids)))
+
+    async def run(self):
+        '''the background revalidation loop. runs forever.'''
+        while True:
+            await asyncio.sleep(self.revalidate_every)
+            try:
+                await self.revalidate()
+            except:
+                traceback.print_exc()
@@ -25,6 +25,19 @@ class Conf:
         self.owner_id = int(self.config.get("Permissions", "OwnerID", fallback=Fallbacks.ownerID))
         self.auth_id = self.config.get("Twitch", "Auth_ID", fallback=Fallbacks.auth_id)
         self.auth_secret = self.config.get("Twitch", "SECRET", fallback=Fallbacks.auth_secret)
+        self.follower_ttl = int(self.config.get("Twitch", "FollowerTTL", fallback=Fallbacks.follower_ttl))
+        self.watched_interval = max(10, int(self.config.get("Twitch", "WatchedInterval", fallback=Fallbacks.watched_interval)))
+        self.category_interval = max(10, int(self.config.get("Twitch", "CategoryInterval", fallback=Fallbacks.category_interval)))
+        self.userinfo_interval = max(10, int(self.config.get("Twitch", "UserInfoInterval", fallback=Fallbacks.userinfo_interval)))
+        self.twitch_concurrency = max(1, int(self.config.get("Twitch", "Concurrency", fallback=Fallbacks.twitch_concurrency)))
+        self.viewer_change_percent = float(self.config.get("Embeds", "ViewerChangePercent", fallback=Fallbacks.viewer_change_percent))
+        self.dispatch_concurrency = max(1, int(self.config.get("Embeds", "DispatchConcurrency", fallback=Fallbacks.dispatch_concurrency)))
+        self.guild_concurrency = max(1, int(self.config.get("Embeds", "GuildConcurrency", fallback=Fallbacks.guild_concurrency)))
+        self.eventsub_port = int(self.config.get("EventSub", "Port", fallback=Fallbacks.eventsub_port))
+        self.eventsub_host = self.config.get("EventSub", "Host", fallback=Fallbacks.eventsub_host)
+        self.eventsub_path = self.config.get("EventSub", "Path", fallback=Fallbacks.eventsub_path)
+        self.eventsub_secret = self.config.get("EventSub", "Secret", fallback=Fallbacks.eventsub_secret)
+        self.eventsub_callback = self.config.get("EventSub", "CallbackURL", fallback=Fallbacks.eventsub_callback)
         self.log_server_id = int(self.config.get("Logging", "ServerID", fallback=Fallbacks.log_server_id))
         self.log_chan_id = int(self.config.get("Logging", "ChannelID", fallback=Fallbacks.log_chan_id))
 
@@ -39,5 +52,18 @@ class Fallbacks:
     ownerID = 0
     auth_id = "no"
     auth_secret = "no"
+    twitch_concurrency = 4
+    follower_ttl = 1800
+    watched_interval = 60
+    category_interval = 300
+    userinfo_interval = 1800
+    viewer_change_percent = 0
+    dispatch_concurrency = 10
+    guild_concurrency = 25
+    eventsub_port = 0
+    eventsub_host = "0.0.0.0"
+    eventsub_path = "/eventsub"
+    eventsub_secret = ""
+    eventsub_callback = ""
     log_server_id = 0
     log_chan_id = 0
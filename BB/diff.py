@@ -0,0 +1,58 @@
+class GuildChanges:
+    '''
+    What one guild has to do this loop, everything keyed by user id:
+        went_online  - user id -> (userinfo, streaminfo) that needs a new message
+        went_offline - user id -> message row whose message needs deleting
+        still_live   - user id -> (message row, (userinfo, streaminfo)) whose message may need editing
+                       (LiveCheck.drop_unchanged takes out the ones that dont)
+    '''
+    __slots__ = ("went_online", "went_offline", "still_live")
+
+    def __init__(self):
+        self.went_online = {}
+        self.went_offline = {}
+        self.still_live = {}
+
+    def empty(self):
+        '''true if there is no discord work to do for the guild'''
+        return len(self.went_online) == 0 and len(self.went_offline) == 0 and len(self.still_live) == 0
+
+
+class StreamDiff:
+    '''
+    Compares what a guild should show with the messages it has, one pass over that guild's own dicts.
+    There is nothing worked out for all guilds at once: a message whose stream isnt among the guild's matched streams
+    goes, whether the stream went offline or just stopped matching, so a global went offline set would add nothing.
+    '''
+    def for_guild(self, messages, guild_streams):
+        '''messages maps user ids to the guilds message rows of (message id, login, user id, fingerprint)
+        guild_streams maps logins to the (userinfo, streaminfo) tuples the guild should show now
+        returns the GuildChanges for the guild'''
+        changes = GuildChanges()
+        wanted = {}
+        for stream in guild_streams.values():
+            user_id = stream[1].user_id
+            wanted[user_id] = stream
+            if user_id not in messages:
+                changes.went_online[user_id] = stream
+        for user_id, row in messages.items():
+            if user_id not in wanted:
+                changes.went_offline[user_id] = row
+            else:
+                changes.still_live[user_id] = (row, wanted[user_id])
+        return changes
+
+
+class NewStreamsOnly:
+    '''
+    Stands in for a StreamDiff while only part of the live streams are known (a category crawl is still going).
+    Streams a guild has no message for get one, nothing gets edited or deleted until the real StreamDiff at the end.
+    '''
+    def for_guild(self, messages, guild_streams):
+        '''same as StreamDiff.for_guild, except only went_online is ever filled in'''
+        changes = GuildChanges()
+        for stream in guild_streams.values():
+            user_id = stream[1].user_id
+            if user_id not in messages:
+                changes.went_online[user_id] = stream
+        return changes
@@ -0,0 +1,69 @@
+import asyncio
+import traceback
+
+from collections import deque
+
+
+class DispatchQueue:
+    '''
+    Queues up discord operations (sends, edits, deletes) in one bucket per channel.
+    Each bucket is drained in order by its own worker, and the workers of different channels run at the same time,
+    so one slow or rate limited channel only holds up itself.
+    discord.py already waits out the per-route rate limits for us, this just keeps too many channels from
+    hitting the api at once (max_concurrency) so the global limit stays out of the way too.
+    submit() returns right away, so the twitch polling never waits for discord.
+    '''
+    def __init__(self, max_concurrency=10):
+        self.queues = {}            # channel id -> deque of (job, future)
+        self.workers = {}           # channel id -> task draining that channels queue
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.in_flight = 0
+        self.finished = 0
+        self.failed = 0
+
+    def submit(self, channel_id, job):
+        '''queue a job for a channel. job is a function taking nothing and returning a coroutine
+        returns a future with the result of the job (or None if it failed)'''
+        future = asyncio.get_event_loop().create_future()
+        self.queues.setdefault(channel_id, deque()).append((job, future))
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.ensure_future(self.drain(channel_id))
+        return future
+
+    async def drain(self, channel_id):
+        '''run the jobs of a channel one after another until there are none left'''
+        queue = self.queues[channel_id]
+        try:
+            while len(queue) > 0:
+                job, future = queue.popleft()
+                result = None
+                async with self.semaphore:
+                    self.in_flight += 1
+                    try:
+                        result = await job()
+                        self.finished += 1
+                    except Exception:
+                        self.failed += 1
+                        traceback.print_exc()
+                    finally:
+                        self.in_flight -= 1
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            del self.workers[channel_id]
+            if len(queue) == 0:
+                del self.queues[channel_id]
+
+    def depth(self):
+        '''the number of jobs waiting or running'''
+        return sum(len(x) for x in self.queues.values()) + self.in_flight
+
+    def stats(self):
+        '''return a short description of the state of the queue'''
+        return (f"{self.depth()} operations queued over {len(self.queues)} channels "
+            f"({self.in_flight} running, {self.finished} finished, {self.failed} failed so far)")
+
+    async def join(self):
+        '''wait until every queued job is done'''
+        while len(self.workers) > 0:
+            await asyncio.gather(*list(self.workers.values()), return_exceptions=True)
@@ -0,0 +1,161 @@
+import sys
+import hmac
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import aiohttp
+import datetime
+import traceback
+
+from aiohttp import web
+from collections import deque
+
+
+def sign(secret, message_id, timestamp, body):
+    '''return the signature header value of a message, the way twitch makes it:
+    hmac sha256 of the message id, timestamp and raw body, keyed with the subscription secret'''
+    if isinstance(secret, str):
+        secret = secret.encode("utf-8")
+    digest = hmac.new(secret, message_id.encode("utf-8") + timestamp.encode("utf-8") + body, hashlib.sha256)
+    return "sha256=" + digest.hexdigest()
+
+
+def parse_timestamp(timestamp):
+    '''turn a twitch timestamp (2019-11-16T10:11:12.634234626Z) into seconds since the epoch, ignoring the fraction'''
+    parsed = datetime.datetime.strptime(timestamp[:19], "%Y-%m-%dT%H:%M:%S")
+    return parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class EventSubReceiver:
+    '''
+    A small web server taking EventSub webhook messages (stream.online, stream.offline, ...) from twitch.
+    Every message has to be signed with the secret (see sign), and be less than max_age seconds old, or it is turned away.
+    Notifications are answered right away and handed to on_event(subscription type, event) in the background,
+    a message id that was already handled once is ignored (twitch resends when it isnt sure we got something).
+    Callback verification challenges are answered, revocations are printed and handed to on_revoke(subscription) if it is given.
+    Anything that can sign messages can stand in for twitch, see send_event.
+    '''
+    def __init__(self, secret, on_event, on_revoke=None, host="0.0.0.0", port=8080, path="/eventsub", max_age=600):
+        self.secret = secret.encode("utf-8")
+        self.on_event = on_event    # coroutine taking the subscription type and the event dict
+        self.on_revoke = on_revoke  # function taking the subscription dict of a revoked subscription
+        self.host = host
+        self.port = port
+        self.path = path
+        self.max_age = max_age
+        self.seen = set()           # the last few message ids, so repeats are dropped
+        self.seen_order = deque()
+        self.runner = None
+        self.received = 0
+        self.rejected = 0
+
+    def verify(self, headers, body, now=None):
+        '''return True if the message is signed with our secret and recent enough'''
+        if now is None:
+            now = time.time()
+        message_id = headers.get("Twitch-Eventsub-Message-Id")
+        timestamp = headers.get("Twitch-Eventsub-Message-Timestamp")
+        signature = headers.get("Twitch-Eventsub-Message-Signature")
+        if message_id is None or timestamp is None or signature is None:
+            return False
+        try:
+            if abs(now - parse_timestamp(timestamp)) > self.max_age:
+                return False
+        except ValueError:
+            return False
+        return hmac.compare_digest(sign(self.secret, message_id, timestamp, body), signature)
+
+    def first_time(self, message_id):
+        '''return True the first time a message id shows up, remembering the last 1000 of them'''
+        if message_id in self.seen:
+            return False
+        self.seen.add(message_id)
+        self.seen_order.append(message_id)
+        if len(self.seen_order) > 1000:
+            self.seen.discard(self.seen_order.popleft())
+        return True
+
+    async def handle(self, request):
+        '''the web handler for every message'''
+        body = await request.read()
+        if not self.verify(request.headers, body):
+            self.rejected += 1
+            return web.Response(status=403)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+        message_type = request.headers.get("Twitch-Eventsub-Message-Type")
+        if message_type == "webhook_callback_verification":
+            return web.Response(text=payload["challenge"], content_type="text/plain")
+        if message_type == "revocation":
+            subscription = payload.get("subscription", {})
+            print(f"EventSub subscription revoked: {subscription.get('type')} {subscription.get('condition')} ({subscription.get('status')})")
+            if self.on_revoke is not None:
+                self.on_revoke(subscription)
+            return web.Response(status=204)
+        if message_type == "notification" and self.first_time(request.headers["Twitch-Eventsub-Message-Id"]):
+            self.received += 1
+            asyncio.ensure_future(self.deliver(payload["subscription"]["type"], payload["event"]))
+        return web.Response(status=204)
+
+    async def deliver(self, subscription_type, event):
+        try:
+            await self.on_event(subscription_type, event)
+        except:
+            traceback.print_exc()
+
+    async def start(self):
+        '''start listening'''
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        print(f"EventSub receiver listening on {self.host}:{self.port}{self.path}")
+
+    async def stop(self):
+        '''stop listening'''
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def stats(self):
+        '''return a short description of what the receiver has seen'''
+        return f"{self.received} notifications received, {self.rejected} messages rejected"
+
+
+async def send_event(url, secret, subscription_type, event, message_type="notification"):
+    '''stand in for twitch: send a signed EventSub message to a receiver and return the response status and text
+    python -m BB.eventsub <url> <secret> stream.online <user id> <login>    does the same from a terminal'''
+    message_id = str(uuid.uuid4())
+    timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+    payload = {"subscription": {"type": subscription_type, "version": "1", "condition": {}}, "event": event}
+    if message_type == "webhook_callback_verification":
+        payload = {"subscription": payload["subscription"], "challenge": message_id}
+    body = json.dumps(payload).encode("utf-8")
+    headers = {
+        "Content-Type": "application/json",
+        "Twitch-Eventsub-Message-Id": message_id,
+        "Twitch-Eventsub-Message-Timestamp": timestamp,
+        "Twitch-Eventsub-Message-Signature": sign(secret, message_id, timestamp, body),
+        "Twitch-Eventsub-Message-Type": message_type,
+    }
+    async with aiohttp.ClientSession() as session:
+        async with session.post(url, data=body, headers=headers) as response:
+            return response.status, await response.text()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 6:
+        print("usage: python -m BB.eventsub <url> <secret> <stream.online|stream.offline> <user id> <login>")
+        sys.exit(1)
+    url, secret, subscription_type, user_id, login = sys.argv[1:]
+    event = {"broadcaster_user_id": user_id, "broadcaster_user_login": login, "broadcaster_user_name": login}
+    if subscription_type == "stream.online":
+        event["type"] = "live"
+        event["started_at"] = datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    print(asyncio.get_event_loop().run_until_complete(send_event(url, secret, subscription_type, event)))
@@ -0,0 +1,124 @@
+import time
+import heapq
+import random
+import asyncio
+import traceback
+
+
+class FollowerCache:
+    '''
+    Keeps the follower count of every live streamer so that posting and editing embeds never waits on it.
+    Follower counts used to be requested once per stream per server every loop, which was the major bottleneck.
+    Now:
+        watch() is told which user ids are live once per loop (all servers together, so each id only counts once)
+        ids never seen before are fetched as soon as possible, `batch` at a time, only held back by the request rate limit
+        everything else is refreshed in the background when it goes stale, spread out over the ttl and `spacing` apart
+        get() only ever reads from the cache
+    '''
+    def __init__(self, fetch, ttl=1800, spacing=1, batch=8):
+        self.fetch = fetch          # coroutine taking a user id and returning the follower count
+        self.ttl = ttl              # seconds a count is considered fresh
+        self.spacing = spacing      # minimum seconds between background refreshes
+        self.batch = batch          # ids never seen before fetched at once
+
+        self.counts = {}            # user id -> (follower count, time fetched)
+        self.watched = set()        # user ids that are live right now
+        self.new = []               # user ids with no count yet, fetched before anything else
+        self.due = []               # heap of (refresh time, user id)
+        self.scheduled = {}         # user id -> the refresh time in the heap that still counts
+        self.wake = asyncio.Event()
+
+    def get(self, user_id, default="Unknown"):
+        '''return the cached follower count (or the default if there isnt one yet). never makes a request.'''
+        hit = self.counts.get(user_id)
+        if hit is None:
+            return default
+        return hit[0]
+
+    def watch(self, user_ids, replace=True):
+        '''set the user ids that are live right now
+        replace=False only adds to the current set (for updating a single server)'''
+        user_ids = set(user_ids)
+        if replace:
+            self.watched = user_ids
+            # drop counts for streams that went offline, theyll be fetched again if they come back
+            for user_id in [x for x in self.counts if x not in user_ids]:
+                del self.counts[user_id]
+                self.scheduled.pop(user_id, None)
+        else:
+            self.watched |= user_ids
+        pending = set(self.new)
+        for user_id in user_ids:
+            if user_id not in self.counts and user_id not in pending:
+                self.new.append(user_id)
+                pending.add(user_id)
+        if len(self.new) > 0:
+            self.wake.set()
+
+    def next_new(self):
+        '''return up to `batch` of the ids with no count yet that are still live'''
+        taken = []
+        while len(self.new) > 0 and len(taken) < self.batch:
+            user_id = self.new.pop(0)
+            if user_id in self.watched and user_id not in self.counts:
+                taken.append(user_id)
+        return taken
+
+    def next_due(self, now=None):
+        '''return (user id, 0) if there is a refresh to do right now or (None, seconds to wait) if not'''
+        if now is None:
+            now = time.time()
+        while len(self.due) > 0:
+            when, user_id = self.due[0]
+            if self.scheduled.get(user_id) != when:
+                # offline now, or this entry is left over from an older fetch
+                heapq.heappop(self.due)
+                continue
+            if when > now:
+                return None, when - now
+            heapq.heappop(self.due)
+            del self.scheduled[user_id]
+            return user_id, 0
+        return None, self.ttl
+
+    def store(self, user_id, count, now=None):
+        '''save a count and schedule its next refresh somewhere in the last quarter of the ttl
+        so that streams which went live together dont all refresh together'''
+        if now is None:
+            now = time.time()
+        self.counts[user_id] = (count, now)
+        self.schedule(user_id, now + self.ttl * random.uniform(0.75, 1.0))
+
+    def schedule(self, user_id, when):
+        '''put a user id on the refresh heap, replacing any earlier entry for it'''
+        self.scheduled[user_id] = when
+        heapq.heappush(self.due, (when, user_id))
+
+    async def refresh(self, user_id):
+        '''fetch and save the count of one user id'''
+        try:
+            self.store(user_id, await self.fetch(user_id))
+        except:
+            traceback.print_exc()
+            # keep showing the old count and try again later
+            # ids that never got a count are picked up again by the next watch()
+            if user_id in self.counts:
+                self.schedule(user_id, time.time() + self.ttl / 4)
+
+    async def run(self):
+        '''the background refresh loop. runs forever.'''
+        while True:
+            new = self.next_new()
+            if len(new) > 0:
+                await asyncio.gather(*[self.refresh(x) for x in new])
+                continue
+            user_id, wait = self.next_due()
+            if user_id is None:
+                self.wake.clear()
+                try:
+                    await asyncio.wait_for(self.wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.refresh(user_id)
+            await asyncio.sleep(self.spacing)
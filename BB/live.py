@@ -1,9 +1,11 @@
 import os
-import shutil
+import time
 import traceback
 import aiohttp
 import asyncio
 import discord
+import hashlib
+import functools
 import configparser
 import datetime as dt
 
@@ -11,6 +13,17 @@ from discord.ext import commands
 
 from BB.DB import *
 from BB.permissions import *
+from BB.ratelimit import TokenBucket
+from BB.followers import FollowerCache
+from BB.catalog import GameCatalog
+from BB.matcher import StreamMatcher, PhraseAutomaton, GuildFilter, CrawlLimits
+from BB.diff import StreamDiff, NewStreamsOnly
+from BB.dispatch import DispatchQueue
+from BB.settings import SettingsFile
+from BB.writer import DBWriter
+from BB.scheduler import PollScheduler
+from BB.eventsub import EventSubReceiver
+from BB.records import StreamRecord, UserRecord
 
 
 class MissingResponseField(Exception):
@@ -29,30 +42,41 @@ class LiveCheck(commands.Cog):
     '''
     Where the bulk of the action happens in terms of checking Twitch for live streams.
     Tries its best to be efficient about sending requests to the Twitch API.
-    Major bottleneck is that for every live stream, a follower count request is made.
-        This issue snowballs quickly.
+    Follower counts are kept by a FollowerCache which refreshes them in the background.
+        Each live stream costs 1 request when first seen and then 1 request per FollowerTTL, no matter how many servers show it.
     Other requests are done in bulk, by chunks of 100 globally.
+        Chunks are fetched concurrently, up to the Concurrency setting in the config.
+    Every request takes a token from a bucket kept in sync with the Ratelimit-* headers, so we wait before a 429 instead of after.
+    The loop runs every WatchedInterval seconds, minus however long the last run took (see PollScheduler).
+    The slower requests only happen every few runs: categories every CategoryInterval, user info every UserInfoInterval.
     The process (loop):
         Get the full list of servers (build a big list of games and names to query)
         Get the list of streamers using these requests:
-            gather_byUser - chunks of 100,              1-n requests
-        Make a map of games and game ids using these requests:
-            get_game_id_by_names - chunks of 100,       1-n requests
-            get_game_name_by_ids - chunks of 100,       1-n requests
-        Get the list of streams by category
-            gather_byGame - run get_game_id_by_names,   2-n requests
-        Get the misc info about streamers/blacklisted streamers
-            gather_userinfo_by_id - chunks of 100,      1-n requests
-        Figure out the streams that went offline and went online
+            gather_byUser - chunks of 100,              1-n requests, every run
+        Make a map of games and game ids using the GameCatalog (only unseen names/ids are requested):
+            get_game_id_by_names - chunks of 100,       0-n requests
+            get_game_name_by_ids - chunks of 100,       0-n requests
+        Get the list of streams by category (see gather_categories)
+            gather_byGame - chunks of 100 game ids,     1-n requests, every CategoryInterval (and for newly watched categories)
+            Every page is matched as it arrives, only the streams some server wants are kept,
+            and servers get new streams from it posted right away (see announce_new_streams)
+            Paging stops once no server could get anything else out of it (min_viewers/max_results, see CrawlLimits)
+        Get the misc info about streamers/blacklisted streamers (see get_userinfo)
+            gather_userinfo_by_id - chunks of 100,      0-n requests, every UserInfoInterval (and for new streamers)
+        Route every stream to the servers that want it (see StreamMatcher)
+        Compare every server's matched streams with its messages (see StreamDiff)
+        Skip servers with nothing to do
+        Update the rest of the servers in their own tasks, up to GuildConcurrency at once (see refresh_guild)
+        Queue the discord work per channel (see DispatchQueue), the loop doesnt wait for it:
         Delete offline streams
+        Tell the follower cache which streams are live (new ones get fetched in the background)
         Push new streams (per stream per server)
             If no game map is set, request the game     1 request for each instance
-            Get the follow count of the stream          1 request per stream
-        Edit streams that didn't go offline
+        Edit streams that didn't go offline, if what they show changed
             If no game map is set, request the game     1 request for each instance
-            Get the follow count of the stream          1 request per stream
-    This means per loop, there are at least 9 requests.
-    For each live streamer, there is 1 more request per server they are visible in.
+    This means per loop, there are at least 3 requests.
+    With the EventSub receiver turned on, stream.online/offline notifications go through the same matching and posting
+    a second after they arrive (see on_stream_event), and the loop fixes up anything they missed.
     '''
     def __init__(self, bot, config):
         self.BarryBot = bot
@@ -62,6 +86,69 @@ class LiveCheck(commands.Cog):
 
         self.sessions = {}
 
+        # limits how many chunked twitch requests are in flight at once (see fetch_chunks)
+        self.request_semaphore = asyncio.Semaphore(self.config.twitch_concurrency)
+        # every helix request takes a token from this (see wait_for_request_window)
+        self.ratelimit = TokenBucket()
+        # every database job and settings file write runs on this ones thread, never on the event loop
+        self.writer = DBWriter()
+        # the messages of every guild, in one database
+        self.messages = MessageStore()
+        self.messages.migrate()
+        # follower counts are only ever read from here while posting (see FollowerCache)
+        self.followers = FollowerCache(self.get_followcount_by_id, ttl=self.config.follower_ttl)
+        # game names and ids are looked up here first, only unseen ones are requested (see GameCatalog)
+        self.games = GameCatalog(self.get_game_id_by_names, self.get_game_name_by_ids, writer=self.writer)
+        # every guilds required title phrases in one automaton, set to None to rebuild it (see get_phrase_automaton)
+        self.phrase_automaton = None
+        # every stream live as of the last full loop, mapping user ids to (userinfo, streaminfo)
+        self.live_snapshot = {}
+        # (user id, fingerprint) -> embed dict, emptied every loop (see render_stream_embed)
+        self.embed_cache = {}
+        # every discord send/edit/delete of the update loop goes through here, one bucket per channel
+        self.dispatch = DispatchQueue(self.config.dispatch_concurrency)
+        # guild ids -> the guild_worker task currently running for them
+        self.guild_tasks = {}
+        # guild ids -> (diff, matched streams, game map) of the update waiting for that task (see queue_guild)
+        self.guild_pending = {}
+        self.guild_semaphore = asyncio.Semaphore(self.config.guild_concurrency)
+        # channel ids -> output channels that have been looked up already (see get_output_channel)
+        self.channels = {}
+        # when the loop runs and what each cycle requests (see PollScheduler)
+        self.scheduler = PollScheduler({
+            "watched": self.config.watched_interval,
+            "categories": self.config.category_interval,
+            "userinfo": self.config.userinfo_interval,
+            "token": 3600,
+        })
+        # game id -> the streams of that category some guild wanted, as of its last crawl (see gather_categories)
+        self.category_streams = {}
+        # user id -> user info of the streamers live as of the last loop (see get_userinfo)
+        self.userinfo = {}
+        # game id -> game name of everything the last full loop matched with
+        self.game_map = {}
+
+        # stream.online/offline notifications, if the receiver is turned on (see on_stream_event)
+        self.eventsub = None
+        # user id -> (time, True if it went online) of every event since the loop last started
+        self.stream_events = {}
+        # user id -> True if it went online, for the events not handled yet
+        self.pending_events = {}
+        self.event_task = None
+        # (subscription type, user id) -> subscription id of every eventsub subscription twitch has for us (see sync_eventsub)
+        # the id is None if it isnt known
+        self.subscriptions = None
+        # (subscription type, user id) -> (failures in a row, when to try again) of subscriptions twitch turned down
+        self.subscribe_failures = {}
+        # login -> user id of every streamer watched by name that has been looked up
+        self.login_ids = {}
+        # login -> when twitch last said there is no such user, those are only asked about again after an hour
+        self.missing_logins = {}
+        if self.config.eventsub_port > 0 and self.config.eventsub_secret != "":
+            self.eventsub = EventSubReceiver(self.config.eventsub_secret, self.on_stream_event, on_revoke=self.on_subscription_revoked,
+                host=self.config.eventsub_host, port=self.config.eventsub_port, path=self.config.eventsub_path)
+            self.bot.loop.create_task(self.eventsub.start())
+
         # generate the bearer token on startup because we dont feel like maintaining it
         # and its not that bad of a thing anyways unless we keep regenerating it every 2 seconds
         self.auth_token = None
@@ -70,6 +157,8 @@ class LiveCheck(commands.Cog):
         self.bot.loop.create_task(self.set_aio())
         self.bot.loop.create_task(self.refresh_token())
         self.bot.loop.create_task(self.livecheck_loop())
+        self.bot.loop.create_task(self.followers.run())
+        self.bot.loop.create_task(self.games.run())
 
     async def set_aio(self):
         # "OAuth" required for any token to validate token
@@ -106,17 +195,23 @@ class LiveCheck(commands.Cog):
     async def livecheck_loop(self):
         failures = []
         while True:
-            await asyncio.sleep(300)
+            # the time the last cycle took counts towards this wait, and the next cycle only starts once it finished
+            await asyncio.sleep(self.scheduler.wait_time())
+            self.scheduler.start_cycle()
             try:
                 if len(failures) > 0:
                     for failure in failures:
                         await self.BarryBot.logchan.send(failure)
                     failures = []
-                if not await self.validate_token():
-                    await self.BarryBot.logchan.send("Token failed to validate. It may have expired. Refreshing.")
-                    expire_time = await self.refresh_token()
-                    await self.BarryBot.logchan.send(f"Token refreshed. It should expire in {expire_time}")
+                if self.scheduler.due("token"):
+                    if not await self.validate_token():
+                        await self.BarryBot.logchan.send("Token failed to validate. It may have expired. Refreshing.")
+                        expire_time = await self.refresh_token()
+                        await self.BarryBot.logchan.send(f"Token refreshed. It should expire in {expire_time}")
+                    self.scheduler.ran("token")
                 await self.aggregate_and_refresh_all()
+                if self.eventsub is not None and self.config.eventsub_callback != "":
+                    await self.sync_eventsub()
             except MissingResponseField as e:
                 failures.append(f"{dt.datetime.utcnow()} Failed due to missing JSON response field\nJSON: {e.json_response} MISSING FIELD: {e.field}")
                 try:
@@ -147,291 +242,530 @@ class LiveCheck(commands.Cog):
     async def cleanupStreams(self, guild_id):
         '''delete old messages'''
         sess = self.sessions[guild_id]
-        if sess.updating: return False
-        sess.updating = True
-        messages = sess.brainDB.getTable("messages")
-        sess.brainDB.emptyTable("messages")
-        sess.created_messages = set()
-        channel = None
-        try:
-            channel = discord.utils.get(self.bot.get_all_channels(), id=int(sess.settings.configuration["channel_id"]))
-        except:
-            return False
-        mm = await channel.send("Searching the past 100 messages to delete...")
-        async for msg in channel.history(limit=100, before=mm):
-            if msg.author == self.bot.user:
-                await msg.delete()
-        await mm.edit(content="Done.", delete_after=5)
-        sess.updating = False
+        if sess.lock.locked(): return False
+        async with sess.lock:
+            messages = await sess.clearMessages()
+            channel = self.get_output_channel(guild_id)
+            if channel is None:
+                return False
+            mm = await channel.send("Searching the past 100 messages to delete...")
+            message_ids = {int(row[0]) for row in messages}
+            async for msg in channel.history(limit=100, before=mm):
+                if msg.author == self.bot.user:
+                    message_ids.add(msg.id)
+            await self.bulk_delete_messages(channel, message_ids)
+            await mm.edit(content="Done.", delete_after=5)
+
+    async def bulk_delete_messages(self, channel, message_ids):
+        '''delete a bunch of messages in a channel in as few requests as possible
+        discord only bulk deletes messages younger than 14 days, 2 to 100 at a time. the rest go one by one.'''
+        # a little margin so nothing turns 14 days old between checking and deleting
+        cutoff = dt.datetime.utcnow() - dt.timedelta(days=14) + dt.timedelta(minutes=5)
+        young = sorted(x for x in message_ids if discord.utils.snowflake_time(x) > cutoff)
+        one_by_one = [x for x in message_ids if discord.utils.snowflake_time(x) <= cutoff]
+        for i in range(0, len(young), 100):
+            chunk = young[i:i+100]
+            if len(chunk) == 1:
+                one_by_one.extend(chunk)
+                continue
+            try:
+                await self.bot.http.delete_messages(channel.id, chunk)
+            except discord.HTTPException:
+                # probably missing Manage Messages, which bulk deletes need even for our own messages
+                one_by_one.extend(chunk)
+        for message_id in one_by_one:
+            try:
+                await self.bot.http.delete_message(channel.id, message_id)
+            except:
+                continue
 
     async def aggregate_and_refresh_all(self, specific_guild=None):
         '''get all streams for all servers'''
         new_stream_dict, game_map = await self.get_streams_for_all_guilds(specific_guild)
+        return await self.refresh_guilds(new_stream_dict, game_map, specific_guild)
+
+    async def refresh_guilds(self, new_stream_dict, game_map, specific_guild=None):
+        '''start bringing the messages of every guild (or just the specific one) up to date with the matched streams
+        without a specific guild, the streams are taken as everything live right now
+        nothing in here waits until the guilds are started, so the polling loop and eventsub never mix their updates
+        guilds still busy with an earlier update get this one right after it (see queue_guild)
+        returns False if the specific guild is locked by a cleanup'''
         # new_stream_dict is:
         # a dict mapping guild ids to dicts, mapping streamer names to tuples of (userinfo, streaminfo)
+        current = {}
+        for guild_streams in new_stream_dict.values():
+            for stream in guild_streams.values():
+                current[stream[1].user_id] = stream
+        diff = StreamDiff()
+        if specific_guild is None:
+            self.live_snapshot = current
+            self.embed_cache = {}
+        # every live stream counts once here, however many guilds show it
+        self.followers.watch(current.keys(), replace=specific_guild is None)
         todo = self.sessions.keys()
         if specific_guild is not None:
             todo = [specific_guild]
         for guild_id in todo:
-            try:
-                if guild_id not in new_stream_dict: continue
-                sess = self.sessions[guild_id]
-                if sess.updating: continue
+            if guild_id not in new_stream_dict: continue
+            sess = self.sessions[guild_id]
+            if sess.lock.locked():
+                # busy with a cleanup
+                if specific_guild is not None:
+                    return False
+                continue
+            if len(sess.created_messages) == 0 and len(new_stream_dict[guild_id]) == 0: continue # nothing to do at all
+            self.queue_guild(guild_id, diff, new_stream_dict[guild_id], game_map)
+        if specific_guild is not None and specific_guild in self.guild_tasks:
+            # someone asked for this guild specifically, so let them know when its actually done
+            return await self.guild_tasks[specific_guild]
+
+    def queue_guild(self, guild_id, diff, guild_streams, game_map):
+        '''have a guild brought up to date with its matched streams, by its own task (see guild_worker)
+        if that task is still busy, the update waits for it instead of being dropped. only one update waits per guild:
+        a full one replaces whatever was waiting, new streams (see NewStreamsOnly) are added to what was waiting'''
+        waiting = self.guild_pending.get(guild_id)
+        if waiting is not None and isinstance(diff, NewStreamsOnly):
+            streams = dict(waiting[1])
+            streams.update(guild_streams)
+            games = dict(waiting[2])
+            games.update(game_map)
+            diff, guild_streams, game_map = waiting[0], streams, games
+        self.guild_pending[guild_id] = (diff, guild_streams, game_map)
+        task = self.guild_tasks.get(guild_id)
+        if task is None or task.done():
+            task = self.loop.create_task(self.guild_worker(guild_id))
+            self.guild_tasks[guild_id] = task
+            task.add_done_callback(functools.partial(self.forget_guild_task, guild_id))
+
+    async def guild_worker(self, guild_id):
+        '''the task of a guild, running refresh_guild with whatever update is waiting until none is
+        returns what the last refresh_guild returned'''
+        result = True
+        while guild_id in self.guild_pending:
+            diff, guild_streams, game_map = self.guild_pending.pop(guild_id)
+            result = await self.refresh_guild(guild_id, diff, guild_streams, game_map)
+        return result
+
+    def forget_guild_task(self, guild_id, task):
+        '''done callback of the guild_worker tasks'''
+        if self.guild_tasks.get(guild_id) is task:
+            del self.guild_tasks[guild_id]
+
+    async def refresh_guild(self, guild_id, diff, guild_streams, game_map):
+        '''bring the messages of one guild up to date. runs as its own task next to the other guilds,
+        at most config.guild_concurrency at once. errors stay inside the guild.
+        returns False if the guild was locked or has no usable channel'''
+        sess = self.sessions[guild_id]
+        async with self.guild_semaphore:
+            if sess.lock.locked(): return False
+            async with sess.lock:
                 try:
-                    channel = discord.utils.get(self.bot.get_all_channels(), id=int(sess.settings.configuration["channel_id"]))
-                except:
-                    continue
-                sess.updating = True
-                old_streams = list(sess.created_messages)
-                old_stream_ids = {x[2] for x in sess.created_messages}
-                dead_streams = set()
-                edit_streams = []
-                new_streams = []
-                for stream in old_streams.copy():
-                    if stream[1] not in new_stream_dict[guild_id]:
-                        old_streams.remove(stream)
-                        old_stream_ids.remove(stream[2])
-                        dead_streams.add(stream)
-                    else:
-                        edit_streams.append((stream[0], new_stream_dict[guild_id][stream[1]]))
-                await self.kill_old_stream(guild_id, dead_streams, channel)
-                new_streams.extend(old_streams)
-                for stream_name, stream in new_stream_dict[guild_id].items():
-                    if stream[1]["user_id"] not in old_stream_ids:
-                        new_streams.append(await self.push_new_stream(guild_id, stream, channel, game_map))
-                await self.update_old_streams(guild_id, edit_streams, channel, game_map)
-                sess.created_messages = set(new_streams)
-                sess.update()
-                sess.updating = False
-            except Exception as e:
-                sess.updating = False
+                    changes = diff.for_guild(sess.created_messages, guild_streams)
+                    await self.drop_unchanged(changes, game_map)
+                    if changes.empty(): return True
+                    channel = self.get_output_channel(guild_id)
+                    if channel is None:
+                        return False
+                    await self.dispatch_guild_changes(guild_id, changes, channel, game_map)
+                    await sess.update()
+                except Exception as e:
+                    await self.BarryBot.logchan.send(f"Error in updating for guild {guild_id} ```\n{''.join(traceback.format_tb(e.__traceback__))}```")
+                    traceback.print_exc()
+        return True
+
+    async def drop_unchanged(self, changes, game_map):
+        '''take the still live streams whose message already shows them closely enough out of the changes,
+        so a guild where nothing changed never gets near discord'''
+        for user_id, (row, stream) in list(changes.still_live.items()):
+            game_name = await self.get_game_name_for_stream(stream[1], game_map)
+            fingerprint = self.stream_fingerprint(stream[1], stream[0], game_name, self.followers.get(user_id))
+            if not self.fingerprint_changed(row[3], fingerprint):
+                del changes.still_live[user_id]
+
+    def dispatch_guild_changes(self, guild_id, changes, channel, game_map):
+        '''queue the discord work for a guild in its channels bucket (see DispatchQueue)
+        returns a future that finishes once all of it is done'''
+        futures = []
+        for user_id, row in changes.went_offline.items():
+            futures.append(self.dispatch.submit(channel.id, functools.partial(self.guild_job, guild_id, self.kill_job, guild_id, user_id, row, channel)))
+        for user_id, stream in changes.went_online.items():
+            futures.append(self.dispatch.submit(channel.id, functools.partial(self.guild_job, guild_id, self.push_job, guild_id, user_id, stream, channel, game_map)))
+        for entry in changes.still_live.values():
+            futures.append(self.dispatch.submit(channel.id, functools.partial(self.guild_job, guild_id, self.update_old_streams, guild_id, [entry], channel, game_map)))
+        return asyncio.gather(*futures)
+
+    async def guild_job(self, guild_id, job, *args):
+        '''run one queued job for a guild, reporting errors without stopping the rest of its jobs'''
+        try:
+            return await job(*args)
+        except Exception as e:
+            traceback.print_exc()
+            try:
                 await self.BarryBot.logchan.send(f"Error in updating for guild {guild_id} ```\n{''.join(traceback.format_tb(e.__traceback__))}```")
-                traceback.print_exc()
-                continue
+            except:
+                pass
+
+    async def kill_job(self, guild_id, user_id, row, channel):
+        '''delete the message of a stream that went offline and forget it
+        if the delete failed the message is kept, so the next loop tries again'''
+        if len(await self.kill_old_stream(guild_id, [row], channel)) > 0:
+            self.sessions[guild_id].created_messages.pop(user_id, None)
+
+    async def push_job(self, guild_id, user_id, stream, channel, game_map):
+        '''post the message of a stream that went live and remember it'''
+        self.sessions[guild_id].created_messages[user_id] = await self.push_new_stream(guild_id, stream, channel, game_map)
 
     async def kill_old_stream(self, guild_id, streams, channel=None):
-        '''delete the message for old streams'''
-        sess = self.sessions[guild_id]
+        '''delete the message for old streams
+        returns the message rows that are gone now, deleted by us or already gone (someone beat us to it)
+        any other error (5xx, ratelimit, missing permissions) is printed and the row left out, so it can be tried again'''
         if channel is None:
-            try:
-                channel = discord.utils.get(self.bot.get_all_channels(), id=int(sess.settings.configuration["channel_id"]))
-            except:
-                return False
+            channel = self.get_output_channel(guild_id)
+            if channel is None:
+                return []
+        gone = []
         for stream in streams:
             try:
-                msg = await channel.fetch_message(stream[0])
-                await msg.delete()
-            except:
+                # straight to the delete route by id, no need to fetch the message first
+                await self.bot.http.delete_message(channel.id, stream[0])
+            except discord.NotFound:
+                # someone beat us to it, theres nothing left to delete
+                pass
+            except Exception as e:
+                traceback.print_exc()
+                print(f"Could not delete message {stream[0]} in guild {guild_id}, trying again next loop: {e}")
                 continue
+            gone.append(stream)
+        return gone
 
     async def push_new_stream(self, guild_id, stream, channel=None, game_map=None):
-        '''push a new message for a new stream'''
+        '''push a new message for a new stream
+        returns the message row of (message id, login, user id, fingerprint)'''
         userinfo = stream[0]
         stream = stream[1]
         sess = self.sessions[guild_id]
         if channel is None:
-            try:
-                channel = discord.utils.get(self.bot.get_all_channels(), id=int(sess.settings.configuration["channel_id"]))
-            except:
+            channel = self.get_output_channel(guild_id)
+            if channel is None:
                 return False
-        game_name = "(No Category)"
-        if game_map is None:
-            try:
-                game_name = (await self.get_game_name_by_ids([stream["game_id"]]))[stream["game_id"]]
-            except:
-                pass
-        elif stream["game_id"] != "0":
-            try:
-                game_name = game_map[stream["game_id"]]
-            except:
-                game_name = "(Unknown Category)"
-        stream_id = stream["user_id"]
-        followers = await self.get_followcount_by_id(stream_id)
-        e = self.produce_stream_embed(stream, userinfo, game_name, followers)
-        msg = await channel.send(embed=e)
-        return (str(msg.id), userinfo["login"], stream_id)
+        game_name = await self.get_game_name_for_stream(stream, game_map)
+        stream_id = stream.user_id
+        followers = self.followers.get(stream_id)
+        fingerprint = self.stream_fingerprint(stream, userinfo, game_name, followers)
+        e = self.render_stream_embed(stream, userinfo, game_name, followers, fingerprint)
+        msg = await self.bot.http.send_message(channel.id, None, embed=e)
+        return (str(msg["id"]), userinfo.login, stream_id, fingerprint)
 
     async def update_old_streams(self, guild_id, streams, channel=None, game_map=None):
         '''edit existing embeds for old streams
-        each entry in the streams list is a tuple of a message_id and a stream object'''
+        each entry in the streams list is a tuple of a message row and a stream object
+        messages are only edited if the fingerprint of what they show changed
+        messages that were deleted by someone else are posted again'''
         sess = self.sessions[guild_id]
         if channel is None:
-            try:
-                channel = discord.utils.get(self.bot.get_all_channels(), id=int(sess.settings.configuration["channel_id"]))
-            except:
+            channel = self.get_output_channel(guild_id)
+            if channel is None:
                 return False
         for duple in streams:
             stream = duple[1][1]
             userinfo = duple[1][0]
-            msg_id = duple[0]
-            msg = None
+            row = duple[0]
+            msg_id = row[0]
+            game_name = await self.get_game_name_for_stream(stream, game_map)
+            stream_id = stream.user_id
+            followers = self.followers.get(stream_id)
+            fingerprint = self.stream_fingerprint(stream, userinfo, game_name, followers)
+            if not self.fingerprint_changed(row[3], fingerprint):
+                continue
+            e = self.render_stream_embed(stream, userinfo, game_name, followers, fingerprint)
             try:
-                msg = await channel.fetch_message(msg_id)
+                # straight to the edit route by id, no need to fetch the message first
+                await self.bot.http.edit_message(channel.id, msg_id, embed=e)
+            except discord.NotFound as ex:
+                if ex.code != 10008:
+                    raise
+                # Unknown Message: someone deleted it, so post it again
+                sess.created_messages[stream_id] = await self.push_new_stream(guild_id, duple[1], channel, game_map)
+                continue
             except:
                 continue
-            game_name = "(No Category)"
-            if game_map is None:
-                try:
-                    game_name = (await self.get_game_name_by_ids([stream["game_id"]]))[stream["game_id"]]
-                except:
-                    pass
-            elif stream["game_id"] != "0":
-                try:
-                    game_name = game_map[stream["game_id"]]
-                except:
-                    game_name = "(Unknown Category)"
-            stream_id = stream["user_id"]
-            followers = await self.get_followcount_by_id(stream_id)
-            e = self.produce_stream_embed(stream, userinfo, game_name, followers)
-            await msg.edit(embed=e)
+            sess.created_messages[stream_id] = (msg_id, row[1], row[2], fingerprint)
+
+    async def get_game_name_for_stream(self, stream, game_map=None):
+        '''return the name of the game to show for a stream'''
+        game_name = "(No Category)"
+        if game_map is None:
+            try:
+                game_name = (await self.games.names_for_ids([stream.game_id]))[stream.game_id]
+            except:
+                pass
+        elif stream.game_id != "0":
+            try:
+                game_name = game_map[stream.game_id]
+            except:
+                game_name = "(Unknown Category)"
+        return game_name
+
+    def stream_fingerprint(self, stream, userinfo, game, follows):
+        '''return a short string that changes when anything shown in the embed for a stream would change
+        the form is "hash:viewers" so the viewer count can be compared separately (see fingerprint_changed)'''
+        title = stream.title.strip() if stream.title is not None else "(blank title)"
+        shown = "\n".join([title, game, str(follows), str(userinfo.broadcaster_type)])
+        return f"{hashlib.sha1(shown.encode('utf-8')).hexdigest()[:16]}:{stream.viewer_count}"
+
+    def fingerprint_changed(self, old, new):
+        '''return true if a message with the old fingerprint should be edited to match the new one
+        viewer count changes smaller than the ViewerChangePercent in the config dont count'''
+        if old is None:
+            return True
+        if old == new:
+            return False
+        old_hash, _, old_viewers = old.partition(":")
+        new_hash, _, new_viewers = new.partition(":")
+        if old_hash != new_hash:
+            return True
+        try:
+            old_viewers = int(old_viewers)
+            new_viewers = int(new_viewers)
+        except ValueError:
+            return True
+        return abs(new_viewers - old_viewers) * 100 > self.config.viewer_change_percent * max(old_viewers, 1)
+
+    def render_stream_embed(self, stream, userinfo, game, follows, fingerprint):
+        '''return the embed for a stream as the dict discord wants
+        its only built once per loop for each version of the stream, no matter how many guilds show it'''
+        key = (stream.user_id, fingerprint)
+        payload = self.embed_cache.get(key)
+        if payload is None:
+            payload = self.produce_stream_embed(stream, userinfo, game, follows).to_dict()
+            self.embed_cache[key] = payload
+        return payload
 
     def produce_stream_embed(self, stream, userinfo, game, follows):
         '''return a discord embed based on the info given'''
-        title = stream["title"].strip() if "title" in stream else "(blank title)"
-        thumb = stream["thumbnail_url"].replace("{width}", "256").replace("{height}", "144")
-        e = discord.Embed(title=f"{stream['user_name']} playing {game}", description = f'"{title}"', color=discord.Color.dark_purple(), timestamp=dt.datetime.utcnow(), url=f"https://twitch.tv/{userinfo['login']}")
+        title = stream.title.strip() if stream.title is not None else "(blank title)"
+        thumb = stream.thumbnail_url.replace("{width}", "256").replace("{height}", "144")
+        e = discord.Embed(title=f"{stream.user_name} playing {game}", description = f'"{title}"', color=discord.Color.dark_purple(), timestamp=dt.datetime.utcnow(), url=f"https://twitch.tv/{userinfo.login}")
         e.set_author(name="Live on Twitch:")
         e.set_footer(text="Twitch", icon_url=self.bot.user.avatar_url)
         e.set_image(url=thumb)
-        e.set_thumbnail(url=userinfo["profile_image_url"])
+        e.set_thumbnail(url=userinfo.profile_image_url)
         e.add_field(name="Followers", value=follows)
-        e.add_field(name="Total Views", value=userinfo["view_count"])
-        e.add_field(name="Current Views", value=stream["viewer_count"])
-        btype = userinfo["broadcaster_type"]
+        e.add_field(name="Total Views", value=userinfo.view_count)
+        e.add_field(name="Current Views", value=stream.viewer_count)
+        btype = userinfo.broadcaster_type
         if btype == "" or btype is None:
             btype = "Non-Affiliate"
         else:
             btype = btype.capitalize()
         e.add_field(name="Status", value=btype)
-        desc = userinfo["description"]
+        desc = userinfo.description
         if desc == "" or desc is None:
             desc = "No description"
         e.add_field(name="Description", value=desc)
         return e
 
     async def get_streams_for_all_guilds(self, specific_guild=None):
-        '''return a dict of all streams for all guilds
-        mapping user ids to stream dicts'''
+        '''return a dict of all streams for all guilds, and the game map
+        mapping guild ids to dicts, mapping logins to tuples of (UserRecord, StreamRecord)'''
+        started = time.time()
         skipped_guilds = set()
         games = set()
         users = set()
-        blacks = set() # blacklisted users
-        whites = set() # whitelisted categories for user defined lists
-        output = {}
         todo = self.sessions.keys()
         if specific_guild is not None:
             todo = [specific_guild]
         for guild_id in todo:
             sess = self.sessions[guild_id]
-            try:
-                channel = discord.utils.get(self.bot.get_all_channels(), id=int(sess.settings.configuration["channel_id"]))
-            except:
+            if self.get_output_channel(guild_id) is None:
                 skipped_guilds.add(guild_id)
                 continue
             # doing these feels redundant and actually useless but im going to leave it here
-            games |= set(sess.settings.get("Config", "defined_games"))
-            users |= set(sess.settings.get("Config", "defined_streams"))
+            games.update(sess.getFilter().defined_games)
+            users.update(sess.getFilter().defined_streams)
         user_streams = await self.gather_byUser(list(users))
         game_ids = set()
         games_to_resolve = set()
         for stream in user_streams:
-            game_ids.add(stream["game_id"])
-        game_id_mappings = await self.get_game_id_by_names(list(games)) # a map of names to ids
+            game_ids.add(stream.game_id)
+        game_id_mappings = await self.games.ids_for_names(list(games)) # a map of names to ids
         game_id_mappings2 = dict((v,k) for k,v in game_id_mappings.items()) # swapped version of that list
         for gameid in game_ids:
             if gameid not in game_id_mappings2:
                 games_to_resolve.add(gameid)
-        additional_mappings = await self.get_game_name_by_ids(list(games_to_resolve))
+        additional_mappings = await self.games.names_for_ids(list(games_to_resolve))
         for k,v in additional_mappings.items():
             game_id_mappings2[k] = v
-        game_streams = await self.gather_byGame(list(games))
+        full_loop = specific_guild is None
+        guild_ids = [x for x in todo if x not in skipped_guilds]
+        matcher = self.build_matcher(game_id_mappings2, guild_ids)
+        limits = CrawlLimits(matcher)
+        async def keep(page):
+            # match each page as it arrives and only keep what some guild wants
+            page_streams = await self.label_page(page)
+            routed = matcher.match(page_streams)
+            limits.add_page(page_streams, routed)
+            wanted = {login for guild_streams in routed.values() for login in guild_streams}
+            missing = [page_streams[x][1].user_id for x in wanted if page_streams[x][0] is None]
+            if len(missing) > 0:
+                for info in await self.gather_userinfo_by_id(missing):
+                    self.userinfo[info.id] = info
+            kept = []
+            for login in wanted:
+                stream = page_streams[login][1]
+                info = self.userinfo.get(stream.user_id, page_streams[login][0])
+                if info is None: continue # the user is gone
+                self.userinfo[stream.user_id] = info
+                page_streams[login] = (info, stream)
+                kept.append(stream)
+            if full_loop:
+                routed = {guild_id: {x: page_streams[x] for x in guild_streams if page_streams[x][0] is not None}
+                    for guild_id, guild_streams in routed.items()}
+                # nothing waits for these, guilds still posting an earlier page get them queued behind it
+                self.announce_new_streams(routed, game_id_mappings2)
+            return kept
+        game_streams = await self.gather_categories(list(game_id_mappings.values()), cached=full_loop, keep=keep, more=limits.more)
+        # categories may be from an earlier crawl, so leave out watched streamers the fresh check found offline
+        user_stream_ids = {x.user_id for x in user_streams}
+        game_streams = [x for x in game_streams
+            if x.user_id in user_stream_ids or (x.login or getattr(self.userinfo.get(x.user_id), "login", None)) not in users]
         unique_combo = game_streams + user_streams
-        all_streams_by_id = {x["user_id"]:x for x in unique_combo}
-        all_stream_ids = {x["user_id"] for x in game_streams} | {x["user_id"] for x in user_streams}
-        all_stream_userinfo = await self.gather_userinfo_by_id(list(all_stream_ids))
+        all_streams_by_id = {x.user_id:x for x in unique_combo}
+        all_stream_ids = {x.user_id for x in game_streams} | user_stream_ids
+        all_stream_userinfo = await self.get_userinfo(list(all_stream_ids), cached=full_loop)
         # building a big dict of streams from the user info and the given streams
         dict_o_streams = {}
         for stream in all_stream_userinfo:
             # maps a login name to a tuple of (user info, stream info)
-            dict_o_streams[stream["login"]] = (stream, all_streams_by_id[stream["id"]])
+            dict_o_streams[stream.login] = (stream, all_streams_by_id[stream.id])
+        if full_loop:
+            self.apply_stream_events(dict_o_streams, started)
+            self.game_map = game_id_mappings2
         # lets get this bread
-        for guild_id in todo:
-            if guild_id in skipped_guilds: continue
-            sess = self.sessions[guild_id]
-            blacks = set(sess.settings.get('Config', "blacklisted_streams"))
-            whites = set(sess.settings.get('Config', "whitelisted_games"))
-            title_contains = set(sess.settings.get('Config', "title_contains"))
-            guild_streams = {}
-            # by game
-            for category in sess.settings.get("Config", "defined_games"):
-                if len(whites) > 0 and category not in whites: continue # skip non whitelisted categories if applicable
-                for name, stream_tuple in dict_o_streams.items():
-                    if stream_tuple[0]["login"] in blacks: continue
-                    if name in guild_streams: continue # skip streams already added
-                    # skip streams not containing the whitelisted word if applicable
-                    if len(title_contains) > 0:
-                        allowed = False
-                        if "title" in stream_tuple[1]:
-                            title = stream_tuple[1]["title"].lower()
-                            for phrase in title_contains:
-                                if phrase in title:
-                                    allowed = True
-                        if not allowed: continue
-                    # game_id sometimes is empty???
-                    if "game_id" in stream_tuple[1]:
-                        game_name = game_id_mappings2.get(stream_tuple[1]["game_id"], None)
-                        if game_name is None: continue
-                        if game_name == category:
-                            guild_streams[name] = stream_tuple
-            # by name
-            for streamer in sess.settings.get("Config", "defined_streams"):
-                if streamer in blacks: continue
-                if streamer in dict_o_streams:
-                    if streamer in guild_streams: continue # skip streams already added
-                    # skip streams not containing the whitelisted word if applicable
-                    if len(title_contains) > 0:
-                        allowed = False
-                        if "title" in stream_tuple[1]:
-                            title = stream_tuple[1]["title"].lower()
-                            for phrase in title_contains:
-                                if phrase in title:
-                                    allowed = True
-                        if not allowed: continue
-                    if len(whites) > 0:
-                        # game_id sometimes is empty???
-                        if "game_id" in dict_o_streams[streamer][1]:
-                            # skip non whitelisted categories if applicable
-                            game_name = game_id_mappings2.get(dict_o_streams[streamer][1]["game_id"], None)
-                            if game_name is not None and game_name.lower() not in whites: continue
-                    guild_streams[streamer] = dict_o_streams[streamer]
-            output[guild_id] = guild_streams
+        output = matcher.match(dict_o_streams)
         # output is:
         # a dict mapping guild ids to dicts, mapping streamer names to tuples of (userinfo, streaminfo)
         return output, game_id_mappings2
 
+    async def label_page(self, page):
+        '''return a dict mapping logins to tuples of (userinfo or None, streaminfo) for a page of streams
+        the login comes with the stream, user info is only requested for streams without one that arent known yet'''
+        missing = [x.user_id for x in page if not x.login and x.user_id not in self.userinfo]
+        found = {}
+        if len(missing) > 0:
+            found = {info.id: info for info in await self.gather_userinfo_by_id(missing)}
+        output = {}
+        for stream in page:
+            info = self.userinfo.get(stream.user_id) or found.get(stream.user_id)
+            login = stream.login or (info.login if info is not None else None)
+            if login:
+                output[login] = (info, stream)
+        return output
+
+    def announce_new_streams(self, new_stream_dict, game_map):
+        '''post the streams guilds dont have a message for yet right away, while the crawl is still going (see NewStreamsOnly)
+        guilds still posting an earlier page get these right after it (see queue_guild).
+        guilds that are locked by a cleanup, or only want their top max_results (which arent known until the crawl ends),
+        get theirs at the end of the loop like usual'''
+        user_ids = set()
+        new_only = NewStreamsOnly()
+        for guild_id, guild_streams in new_stream_dict.items():
+            sess = self.sessions[guild_id]
+            if sess.lock.locked(): continue
+            if sess.getFilter().max_results > 0: continue
+            fresh = {login: stream for login, stream in guild_streams.items() if stream[1].user_id not in sess.created_messages}
+            if len(fresh) == 0: continue
+            user_ids.update(stream[1].user_id for stream in fresh.values())
+            self.queue_guild(guild_id, new_only, fresh, game_map)
+        if len(user_ids) > 0:
+            self.followers.watch(user_ids, replace=False)
+
+    def build_matcher(self, game_map, guild_ids):
+        '''return a StreamMatcher for the given guilds, game_map maps game ids to names'''
+        matcher = StreamMatcher(game_map, self.get_phrase_automaton())
+        for guild_id in guild_ids:
+            matcher.add_guild(guild_id, self.sessions[guild_id].getFilter())
+        return matcher
+
+    def route_streams(self, dict_o_streams, game_map, guild_ids):
+        '''match streams to the given guilds (see StreamMatcher)
+        dict_o_streams maps logins to tuples of (userinfo, streaminfo), game_map maps game ids to names
+        returns a dict mapping guild ids to dicts, mapping streamer names to tuples of (userinfo, streaminfo)'''
+        return self.build_matcher(game_map, guild_ids).match(dict_o_streams)
+
+    def apply_stream_events(self, dict_o_streams, since):
+        '''eventsub may have said a stream went on or offline while the loop was requesting things,
+        and twitch doesnt always list streams right after they change. so what eventsub said wins for those,
+        and the events from before the loop started are forgotten (the loop saw the result of those itself)'''
+        for user_id, (when, online) in list(self.stream_events.items()):
+            if when < since:
+                del self.stream_events[user_id]
+                continue
+            known = self.live_snapshot.get(user_id)
+            if online and known is not None:
+                dict_o_streams.setdefault(known[0].login, known)
+            elif not online:
+                info = known[0] if known is not None else self.userinfo.get(user_id)
+                if info is not None:
+                    dict_o_streams.pop(info.login, None)
+
+    def get_output_channel(self, guild_id):
+        '''return the output channel of a guild, or None if it isnt set or doesnt exist anymore
+        looked up through the guild instead of scanning every channel the bot can see, and remembered after that'''
+        channel_id = self.sessions[guild_id].getFilter().channel_id
+        if channel_id is None:
+            return None
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                return None
+            channel = guild.get_channel(channel_id)
+            if channel is None:
+                return None
+            self.channels[channel_id] = channel
+        return channel
+
+    def get_phrase_automaton(self):
+        '''return the automaton of every guilds required phrases, building it if something changed since last time'''
+        if self.phrase_automaton is None:
+            phrases = {}
+            for guild_id, sess in self.sessions.items():
+                for phrase in sess.getFilter().title_contains:
+                    phrases.setdefault(phrase, set()).add(guild_id)
+            self.phrase_automaton = PhraseAutomaton(phrases)
+        return self.phrase_automaton
+
     async def wait_for_request_window(self, url):
-        '''sometimes we get rate limited. wait for the rate limit window by doing this.'''
+        '''every helix request goes through here to take a token from the shared rate limit bucket.
+        if we get rate limited anyways, wait exactly until the bucket resets and try again.'''
         attempt = True
         quit_threshold = 0
         output = {}
         while attempt and quit_threshold < 60:
-            async with self.aio_session.get(url) as response:
-                output = await response.json()
-                if "status" in output:
-                    print(f"Had status {output['status']} error.")
-                    if output["status"] == 429:
-                        print("\tWaiting for 15 seconds.")
-                        try:
-                            await self.BarryBot.logchan.send(f"Hit rate limit while checking URL: {url}")
-                        except:
-                            pass
-                        await asyncio.sleep(15)
-                    else:
-                        print(f"\t{output}")
-                        quit_threshold += 1
-                        await asyncio.sleep(1)
+            await self.ratelimit.acquire()
+            headers = None
+            try:
+                async with self.aio_session.get(url) as response:
+                    headers = response.headers
+                    output = await response.json()
+            finally:
+                self.ratelimit.release(headers)
+            if "status" in output:
+                print(f"Had status {output['status']} error.")
+                if output["status"] == 429:
+                    self.ratelimit.exhaust()
+                    print(f"\tWaiting for {self.ratelimit.wait_time():.1f} seconds.")
+                    try:
+                        await self.BarryBot.logchan.send(f"Hit rate limit while checking URL: {url}")
+                    except:
+                        pass
                 else:
-                    attempt = False
+                    print(f"\t{output}")
+                    quit_threshold += 1
+                    await asyncio.sleep(1)
+            else:
+                attempt = False
         return output
 
     def get_json_field(self, json_response, field):
@@ -441,49 +775,312 @@ class LiveCheck(commands.Cog):
         else:
             raise MissingResponseField(json_response, field)
 
-    async def gather_byGame(self, games):
-        '''return the list of streams streaming the list of games given'''
-        game_ids = list((await self.get_game_id_by_names(games)).values())
-        paginating = True
-        stream_list = []
-        for i in range(0, len(game_ids), 100):
-            paginating = True
-            cursor = ""
-            while paginating:
-                this = f"https://api.twitch.tv/helix/streams?{'&'.join([f'game_id={x}' for x in game_ids[i:i+100]])}&first=100{cursor}"
-                json_response = await self.wait_for_request_window(this)
-                if len(self.get_json_field(json_response, "data")) != 100:
-                    paginating = False
-                else:
+    async def fetch_chunks(self, items, build_url, paginate=False, parse=None):
+        '''run the request (or request chain, if paginating) for every chunk of 100 items
+        up to config.twitch_concurrency chunks are in flight at once, the rest wait their turn
+        build_url is given the chunk and the cursor string (empty on the first page)
+        returns the combined "data" lists in chunk order, regardless of which chunk finished first
+        parse, if given, turns every entry of "data" into something else (a StreamRecord or UserRecord) as soon as it arrives'''
+        async def fetch_one(chunk):
+            async with self.request_semaphore:
+                output = []
+                cursor = ""
+                while True:
+                    json_response = await self.wait_for_request_window(build_url(chunk, cursor))
+                    data = self.get_json_field(json_response, "data")
+                    output.extend(data if parse is None else [parse(x) for x in data])
+                    if not paginate or len(data) != 100:
+                        return output
                     cursor = f'&after={self.get_json_field(json_response, "pagination")["cursor"]}'
-                stream_list.extend(self.get_json_field(json_response, "data"))
-        return stream_list
+        chunks = [items[i:i+100] for i in range(0, len(items), 100)]
+        results = await asyncio.gather(*[fetch_one(chunk) for chunk in chunks])
+        return [x for result in results for x in result]
+
+    async def fetch_pages(self, items, build_url, paginate=False, buffered=4, more=None, parse=None):
+        '''like fetch_chunks, except the "data" of every page is yielded as soon as it arrives instead of all of it at the end
+        pages of different chunks come in whatever order they finish in
+        at most `buffered` pages wait to be taken, the requests pause until there is room again,
+        so no more than a few pages are ever held at once however big the crawl is
+        stopping early (breaking out of the loop) cancels the requests that are left
+        more, if given, is asked with the chunk and the page it just got before asking for the next one,
+        and the chunk stops paging if it says False. it sees the page right away, not after the pages waiting in line
+        parse works like it does for fetch_chunks'''
+        queue = asyncio.Queue(maxsize=buffered)
+        finished = object()
+        async def fetch_one(chunk):
+            cursor = ""
+            while True:
+                # the semaphore is only held for the request itself, never while waiting for room in the queue
+                async with self.request_semaphore:
+                    json_response = await self.wait_for_request_window(build_url(chunk, cursor))
+                data = self.get_json_field(json_response, "data")
+                page = data if parse is None else [parse(x) for x in data]
+                await queue.put(page)
+                if not paginate or len(data) != 100:
+                    return
+                if more is not None and not more(chunk, page):
+                    return
+                cursor = f'&after={self.get_json_field(json_response, "pagination")["cursor"]}'
+        async def fetch_all(tasks):
+            try:
+                await asyncio.gather(*tasks)
+            except Exception as e:
+                await queue.put(e)
+            else:
+                await queue.put(finished)
+        chunks = [items[i:i+100] for i in range(0, len(items), 100)]
+        tasks = [asyncio.ensure_future(fetch_one(chunk)) for chunk in chunks]
+        runner = asyncio.ensure_future(fetch_all(tasks))
+        try:
+            while True:
+                page = await queue.get()
+                if page is finished:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield page
+        finally:
+            for task in tasks + [runner]:
+                task.cancel()
+
+    async def gather_categories(self, game_ids, cached=True, keep=None, more=None):
+        '''return the streams of the given game ids
+        every category is only crawled again when the scheduler says so (see PollScheduler), in between the streams
+        of the last crawl are used and only categories nobody watched before get crawled
+        keep, if given, is awaited with every page as it arrives and returns the streams of it worth keeping,
+        everything else is dropped right away
+        more, if given, decides whether a chunk of game ids keeps paging (see CrawlLimits)
+        cached=False crawls them all and leaves the stored streams alone'''
+        async def crawl(ids):
+            kept = []
+            async for page in self.gather_byGame(ids, more):
+                kept.extend(page if keep is None else await keep(page))
+            return kept
+        if not cached:
+            return await crawl(game_ids)
+        started = time.time()
+        due = self.scheduler.due("categories", started)
+        if due:
+            self.category_streams = {}
+        to_crawl = [x for x in game_ids if x not in self.category_streams]
+        if len(to_crawl) > 0:
+            streams = await crawl(to_crawl)
+            for game_id in to_crawl:
+                self.category_streams[game_id] = []
+            for stream in streams:
+                self.category_streams.setdefault(stream.game_id, []).append(stream)
+        if due:
+            self.scheduler.ran("categories", started)
+        wanted = set(game_ids)
+        for game_id in [x for x in self.category_streams if x not in wanted]:
+            del self.category_streams[game_id]
+        return [stream for game_id in game_ids for stream in self.category_streams.get(game_id, [])]
+
+    async def get_userinfo(self, user_ids, cached=True):
+        '''return the user info of the given user ids
+        user info hardly ever changes, so only ids without any get requested, except when the scheduler says
+        its time to refresh all of it (see PollScheduler). only the given ids are kept around
+        cached=False requests all of them and leaves the stored info alone'''
+        if not cached:
+            return await self.gather_userinfo_by_id(user_ids)
+        started = time.time()
+        due = self.scheduler.due("userinfo", started)
+        to_fetch = user_ids if due else [x for x in user_ids if x not in self.userinfo]
+        fresh = {}
+        if len(to_fetch) > 0:
+            for info in await self.gather_userinfo_by_id(to_fetch):
+                fresh[info.id] = info
+        self.userinfo = {x: fresh.get(x, self.userinfo.get(x)) for x in user_ids if x in fresh or x in self.userinfo}
+        if due:
+            self.scheduler.ran("userinfo", started)
+        return list(self.userinfo.values())
+
+    async def on_stream_event(self, subscription_type, event):
+        '''called by the EventSubReceiver for every notification
+        events are collected for a second and then handled together (see handle_stream_events)'''
+        if subscription_type == "stream.online":
+            online = True
+        elif subscription_type == "stream.offline":
+            online = False
+        else:
+            return
+        user_id = event["broadcaster_user_id"]
+        self.stream_events[user_id] = (time.time(), online)
+        self.pending_events[user_id] = online
+        if self.event_task is None:
+            self.event_task = self.loop.create_task(self.handle_stream_events())
+
+    async def handle_stream_events(self):
+        '''bring every guild up to date with the streams eventsub said went on or offline,
+        through the same matching and posting as the polling loop. the polling loop still catches anything missed here'''
+        await asyncio.sleep(1)
+        events, self.pending_events, self.event_task = self.pending_events, {}, None
+        try:
+            await self.refresh_for_events(events)
+        except Exception as e:
+            traceback.print_exc()
+            try:
+                await self.BarryBot.logchan.send(f"Error in handling eventsub notifications ```\n{''.join(traceback.format_tb(e.__traceback__))}```")
+            except:
+                pass
+
+    async def refresh_for_events(self, events):
+        '''the work of handle_stream_events. events maps user ids to True if they went online'''
+        online = [user_id for user_id, went_online in events.items() if went_online]
+        offline = {user_id for user_id, went_online in events.items() if not went_online}
+        # the event doesnt say what is being streamed, so ask. twitch can take a moment to list a stream that just went live,
+        # those are left for the polling loop
+        streams = await self.gather_byUserId(online) if len(online) > 0 else []
+        unknown = [x.user_id for x in streams if x.user_id not in self.userinfo]
+        if len(unknown) > 0:
+            for info in await self.gather_userinfo_by_id(unknown):
+                self.userinfo[info.id] = info
+        game_map = dict(self.game_map)
+        game_map.update(await self.games.names_for_ids(list({x.game_id for x in streams if x.game_id})))
+        # nothing waits from here on, so the snapshot cant change in the meantime
+        dict_o_streams = {info.login: (info, stream) for user_id, (info, stream) in self.live_snapshot.items() if user_id not in offline}
+        for stream in streams:
+            info = self.userinfo.get(stream.user_id)
+            if info is not None:
+                dict_o_streams[info.login] = (info, stream)
+        guild_ids = [x for x in self.sessions if self.get_output_channel(x) is not None]
+        await self.refresh_guilds(self.route_streams(dict_o_streams, game_map, guild_ids), game_map)
+
+    async def sync_eventsub(self):
+        '''make sure every streamer watched by name has stream.online and stream.offline subscriptions
+        sending to our receiver, and nobody else does. the existing subscriptions are only requested once,
+        subscriptions twitch turns down are tried again later and later (see create_subscription)'''
+        if self.subscriptions is None:
+            self.subscriptions = {}
+            cursor = ""
+            while True:
+                json_response = await self.wait_for_request_window(f"https://api.twitch.tv/helix/eventsub/subscriptions?first=100{cursor}")
+                for subscription in self.get_json_field(json_response, "data"):
+                    if subscription["type"] not in ("stream.online", "stream.offline"): continue
+                    if subscription.get("transport", {}).get("callback") != self.config.eventsub_callback: continue
+                    if subscription["status"] in ("enabled", "webhook_callback_verification_pending"):
+                        self.subscriptions[(subscription["type"], subscription["condition"].get("broadcaster_user_id"))] = subscription["id"]
+                after = json_response.get("pagination", {}).get("cursor")
+                if not after:
+                    break
+                cursor = f"&after={after}"
+        now = time.time()
+        logins = set()
+        for guild_id, sess in self.sessions.items():
+            if self.get_output_channel(guild_id) is not None:
+                logins.update(sess.getFilter().defined_streams)
+        unknown = [x for x in logins if x not in self.login_ids and now - self.missing_logins.get(x, 0) >= 3600]
+        if len(unknown) > 0:
+            for info in await self.gather_userinfo_by_login(unknown):
+                self.login_ids[info.login] = info.id
+            for login in unknown:
+                if login not in self.login_ids:
+                    self.missing_logins[login] = now
+        watched = set()
+        for login in logins:
+            user_id = self.login_ids.get(login)
+            if user_id is None: continue
+            watched.add(user_id)
+            for subscription_type in ("stream.online", "stream.offline"):
+                key = (subscription_type, user_id)
+                if key in self.subscriptions: continue
+                failures = self.subscribe_failures.get(key)
+                if failures is not None and now < failures[1]: continue
+                await self.create_subscription(subscription_type, user_id)
+        for key, subscription_id in list(self.subscriptions.items()):
+            if key[1] not in watched:
+                await self.delete_subscription(key, subscription_id)
+        for key in [x for x in self.subscribe_failures if x[1] not in watched]:
+            del self.subscribe_failures[key]
+
+    async def create_subscription(self, subscription_type, user_id):
+        '''ask twitch to send a type of event for a user to our receiver
+        if it says no the next try waits a minute, doubling with every failure in a row up to a day'''
+        body = {
+            "type": subscription_type,
+            "version": "1",
+            "condition": {"broadcaster_user_id": user_id},
+            "transport": {"method": "webhook", "callback": self.config.eventsub_callback, "secret": self.config.eventsub_secret},
+        }
+        await self.ratelimit.acquire()
+        headers = None
+        try:
+            async with self.aio_session.post("https://api.twitch.tv/helix/eventsub/subscriptions", json=body) as response:
+                headers = response.headers
+                status = response.status
+                json_response = await response.json() if status == 202 else None
+        finally:
+            self.ratelimit.release(headers)
+        key = (subscription_type, user_id)
+        if status == 202:
+            self.subscriptions[key] = json_response["data"][0]["id"]
+            self.subscribe_failures.pop(key, None)
+        elif status == 409:
+            # it already exists, the id turns up the next time the subscriptions are listed
+            self.subscriptions[key] = None
+            self.subscribe_failures.pop(key, None)
+        else:
+            failures = self.subscribe_failures.get(key, (0, 0))[0] + 1
+            self.subscribe_failures[key] = (failures, time.time() + min(60 * 2 ** (failures - 1), 86400))
+            print(f"Failed to subscribe to {subscription_type} for {user_id}: status {status}, {failures} times in a row")
+
+    async def delete_subscription(self, key, subscription_id):
+        '''ask twitch to stop sending a subscription nobody needs anymore
+        key is the (subscription type, user id) of it. without the id the subscriptions are listed again next time'''
+        if subscription_id is None:
+            self.subscriptions = None
+            return
+        await self.ratelimit.acquire()
+        headers = None
+        try:
+            async with self.aio_session.delete(f"https://api.twitch.tv/helix/eventsub/subscriptions?id={subscription_id}") as response:
+                headers = response.headers
+                status = response.status
+        finally:
+            self.ratelimit.release(headers)
+        # 404 means it is already gone
+        if status in (204, 404):
+            if self.subscriptions is not None:
+                self.subscriptions.pop(key, None)
+        else:
+            print(f"Failed to unsubscribe from {key[0]} for {key[1]}: status {status}")
+
+    def on_subscription_revoked(self, subscription):
+        '''called by the EventSubReceiver when twitch revokes a subscription, so sync_eventsub asks for it again'''
+        key = (subscription.get("type"), subscription.get("condition", {}).get("broadcaster_user_id"))
+        if self.subscriptions is not None:
+            self.subscriptions.pop(key, None)
+
+    async def gather_byGame(self, game_ids, more=None):
+        '''yield the pages of streams streaming the list of game ids given, as they arrive (see fetch_pages)'''
+        async for page in self.fetch_pages(game_ids,
+            lambda chunk, cursor: f"https://api.twitch.tv/helix/streams?{'&'.join([f'game_id={x}' for x in chunk])}&first=100{cursor}",
+            paginate=True, parse=StreamRecord.from_json, more=more):
+            yield page
 
     async def gather_byUser(self, users):
         '''return the list of streams by user, if the user is live'''
-        paginating = True
-        stream_list = []
-        for i in range(0, len(users), 100):
-            paginating = True
-            cursor = ""
-            while paginating:
-                this = f"https://api.twitch.tv/helix/streams?{'&'.join([f'user_login={x}' for x in users[i:i+100]])}&first=100{cursor}"
-                json_response = await self.wait_for_request_window(this)
-                if len(self.get_json_field(json_response, "data")) != 100:
-                    paginating = False
-                else:
-                    cursor = f'&after={self.get_json_field(json_response, "pagination")["cursor"]}'
-                stream_list.extend(self.get_json_field(json_response, "data"))
-        return stream_list
+        return await self.fetch_chunks(users,
+            lambda chunk, cursor: f"https://api.twitch.tv/helix/streams?{'&'.join([f'user_login={x}' for x in chunk])}&first=100{cursor}",
+            paginate=True, parse=StreamRecord.from_json)
+
+    async def gather_byUserId(self, user_ids):
+        '''return the list of streams by user id, if the user is live'''
+        return await self.fetch_chunks(user_ids,
+            lambda chunk, cursor: f"https://api.twitch.tv/helix/streams?{'&'.join([f'user_id={x}' for x in chunk])}&first=100{cursor}",
+            paginate=True, parse=StreamRecord.from_json)
+
+    async def gather_userinfo_by_login(self, logins):
+        '''return the list of users by login'''
+        return await self.fetch_chunks(logins,
+            lambda chunk, cursor: f"https://api.twitch.tv/helix/users?{'&'.join([f'login={x}' for x in chunk])}",
+            parse=UserRecord.from_json)
 
     async def gather_userinfo_by_id(self, users):
         '''return the list of users by id, for extra info'''
-        stream_list = []
-        for i in range(0, len(users), 100):
-            this = f"https://api.twitch.tv/helix/users?{'&'.join([f'id={x}' for x in users[i:i+100]])}"
-            json_response = await self.wait_for_request_window(this)
-            stream_list.extend(self.get_json_field(json_response, "data"))
-        return stream_list
+        return await self.fetch_chunks(users,
+            lambda chunk, cursor: f"https://api.twitch.tv/helix/users?{'&'.join([f'id={x}' for x in chunk])}",
+            parse=UserRecord.from_json)
     
     async def get_followcount_by_id(self, user_id):
         '''return the number of followers for a user id'''
@@ -497,13 +1094,9 @@ class LiveCheck(commands.Cog):
         game_names needs to be a list of strings
         returns a dict mapping those names to ids
         '''
-        game_ids = {}
-        for i in range(0, len(game_names), 100):
-            this = f"https://api.twitch.tv/helix/games?{'&'.join([f'name={x}' for x in game_names[i:i+100]])}"
-            json_response = await self.wait_for_request_window(this)
-            for game in self.get_json_field(json_response, "data"):
-                game_ids[game["name"]] = game["id"]
-        return game_ids
+        games = await self.fetch_chunks(game_names,
+            lambda chunk, cursor: f"https://api.twitch.tv/helix/games?{'&'.join([f'name={x}' for x in chunk])}")
+        return {game["name"]: game["id"] for game in games}
 
     async def get_game_name_by_ids(self, game_ids):
         '''
@@ -511,25 +1104,40 @@ class LiveCheck(commands.Cog):
         game_ids needs to be a list of strings
         returns a dict mapping those ids to names
         '''
-        game_names = {}
-        for i in range(0, len(game_ids), 100):
-            this = f"https://api.twitch.tv/helix/games?{'&'.join([f'id={x}' for x in game_ids[i:i+100]])}"
-            json_response = await self.wait_for_request_window(this)
-            for game in self.get_json_field(json_response, "data"):
-                game_names[game["id"]] = game["name"]
-        return game_names
+        games = await self.fetch_chunks(game_ids,
+            lambda chunk, cursor: f"https://api.twitch.tv/helix/games?{'&'.join([f'id={x}' for x in chunk])}")
+        return {game["id"]: game["name"] for game in games}
 
     @commands.Cog.listener()
     async def on_ready(self):
+        # on_ready fires again after a reconnect, the sessions already open are kept
+        # (a new one would load settings that may not be written yet, and running updates would save to the old one)
         for guild in self.bot.guilds:
-            self.sessions[guild.id] = LiveBrain(guild.id, self.config)
-            self.sessions[guild.id].settings.verify()
+            if guild.id not in self.sessions:
+                await self.open_session(guild.id)
+        self.phrase_automaton = None
 
     @commands.Cog.listener()
     async def on_guild_join(self, guild):
         if guild.id not in self.sessions:
-            self.sessions[guild.id] = LiveBrain(guild.id, self.config)
-            self.sessions[guild.id].settings.verify()
+            await self.open_session(guild.id)
+            self.phrase_automaton = None
+
+    async def open_session(self, guild_id):
+        '''make the LiveBrain of a guild, only letting the loop see it once its messages are loaded'''
+        sess = LiveBrain(guild_id, self.config, self.messages, self.writer)
+        sess.settings.verify()
+        await sess.compile()
+        self.sessions[guild_id] = sess
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel):
+        self.channels.pop(channel.id, None)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        for channel in guild.channels:
+            self.channels.pop(channel.id, None)
 
     @commands.command()
     @commands.check(Perms.is_owner)
@@ -547,16 +1155,44 @@ class LiveCheck(commands.Cog):
     async def globalupdate(self, ctx):
         '''- Force update every server for the bot'''
         await self.aggregate_and_refresh_all()
+        await self.dispatch.join()
         print("Finished update of all guilds.")
         await ctx.send("Finished update of all guilds.")
 
+    @commands.command()
+    @commands.check(Perms.is_owner)
+    async def dispatchstatus(self, ctx):
+        '''- Show how much discord work is waiting to be done'''
+        await ctx.send(f"```\n{self.dispatch.stats()}```")
+
+    @commands.command()
+    @commands.check(Perms.is_owner)
+    async def pollstatus(self, ctx):
+        '''- Show how often each kind of twitch request is made and when it last was'''
+        status = self.scheduler.stats()
+        if self.eventsub is not None:
+            status += f"\neventsub: {self.eventsub.stats()}"
+        await ctx.send(f"```\n{status}```")
+
+    @commands.command()
+    @commands.check(Perms.is_owner)
+    async def dbstatus(self, ctx):
+        '''- Show how long database work has been taking'''
+        await ctx.send(f"```\n{self.writer.stats()}```")
+
     @commands.command()
     @commands.check(Perms.is_owner)
     async def globalerase(self, ctx):
         '''- Force erase stream messages in every server for the bot'''
-        for guild in self.sessions:
-            await self.cleanupStreams(guild)
-            print(f"Finished deletion of guild {guild}")
+        async def erase(guild):
+            async with self.guild_semaphore:
+                try:
+                    await self.cleanupStreams(guild)
+                    print(f"Finished deletion of guild {guild}")
+                except:
+                    traceback.print_exc()
+                    print(f"Failed deletion of guild {guild}")
+        await asyncio.gather(*[erase(guild) for guild in list(self.sessions)])
         await ctx.send("Finished deleting all messages.")
 
     @commands.command(aliases=["blacklist"])
@@ -639,6 +1275,7 @@ class LiveCheck(commands.Cog):
                 removed.add(phrase)
             else:
                 added.add(phrase)
+        self.phrase_automaton = None
         finalout = ""
         if len(removed) > 0:
             finalout += f"Removed {len(removed)} phrases:\n```\n" + "\n".join(sorted(removed)) + "```"
@@ -686,12 +1323,42 @@ class LiveCheck(commands.Cog):
         else:
             return await ctx.send(f"{streamer}'s streams will be watched.")
 
+    @commands.command(aliases=["minviewers"])
+    @commands.check(Perms.is_guild_mod)
+    async def min_viewers(self, ctx, viewers : int = None):
+        '''- Only show streams from watched categories with at least this many viewers. 0 shows all of them.'''
+        sess = self.sessions[ctx.guild.id]
+        if viewers is None:
+            current = sess.getFilter().min_viewers
+            if current == 0:
+                return await ctx.send("Streams from watched categories are shown regardless of viewers.")
+            return await ctx.send(f"Streams from watched categories need at least {current} viewers to be shown.")
+        sess.setMinViewers(max(0, viewers))
+        if viewers <= 0:
+            return await ctx.send("Streams from watched categories will be shown regardless of viewers.")
+        return await ctx.send(f"Streams from watched categories will need at least {viewers} viewers to be shown.")
+
+    @commands.command(aliases=["maxresults", "top"])
+    @commands.check(Perms.is_guild_mod)
+    async def max_results(self, ctx, results : int = None):
+        '''- Only show this many of the biggest streams from watched categories. 0 shows all of them.'''
+        sess = self.sessions[ctx.guild.id]
+        if results is None:
+            current = sess.getFilter().max_results
+            if current == 0:
+                return await ctx.send("Every stream from watched categories is shown.")
+            return await ctx.send(f"Only the {current} biggest streams from watched categories are shown.")
+        sess.setMaxResults(max(0, results))
+        if results <= 0:
+            return await ctx.send("Every stream from watched categories will be shown.")
+        return await ctx.send(f"Only the {results} biggest streams from watched categories will be shown.")
+
     @commands.command(name="resetstreams", aliases=["resetusers"])
     @commands.check(Perms.is_guild_mod)
     async def reset_streams(self, ctx):
         '''- Reset the list of streamers watched to empty it.'''
         sess = self.sessions[ctx.guild.id]
-        sess.settings.modify("Config", "defined_streams", "")
+        sess.setStreamers([])
         return await ctx.send("I have reset the list of streamers watched.")
 
     @commands.command(name="streamsfromlist", aliases=["bulkusers", "bulkstreams"])
@@ -699,8 +1366,7 @@ class LiveCheck(commands.Cog):
     async def bulk_add_streams(self, ctx, *streamers):
         '''- Replace the current list of streamers by another list of streamers.'''
         sess = self.sessions[ctx.guild.id]
-        the_streamers = "^^".join(streamers).lower()
-        sess.settings.modify("Config", "defined_streams", the_streamers)
+        sess.setStreamers([x.lower() for x in streamers])
         return await ctx.send(f"I have reset the watched stream list to {len(streamers)} streamers.")
 
     @commands.command(name="channel", aliases=["chan", "setchan"])
@@ -718,6 +1384,7 @@ class LiveCheck(commands.Cog):
                 return await ctx.send("There is no set output channel.")
             else:
                 return await ctx.send(f"The current output channel is {channel.mention}")
+        self.channels.pop(sess.getFilter().channel_id, None)
         sess.setChannel(chan.id)
         return await ctx.send(f"The current output channel is now {chan.mention}")
 
@@ -761,45 +1428,57 @@ class LiveCheck(commands.Cog):
             return await ctx.send(f"Livestreams have been updated in {channel.mention}")
 
 class LiveBrain:
-    ''' like a brain for each server, a db instance, whatever you want (also holds a ServerSettings instance)'''
-    def __init__(self, serverID, config):
+    ''' like a brain for each server, its part of the shared message store, whatever you want (also holds a ServerSettings instance)'''
+    def __init__(self, serverID, config, store, writer=None):
         self.serverID = str(serverID)
-        self.brainDB = GeneralDB("live_"+self.serverID)
-        self.verifyTables()
+        self.store = store # the MessageStore shared by every server
+        self.writer = writer # the DBWriter every store call goes through, if there is one
         
-        # this holds a dict called configuration which holds 5 keys
-        # "defined_streams", "defined_games", "blacklisted_streams", "whitelisted_games", "title_contains", "channel_id"
-        # the first 5 are strings in the form of a list while the last is a single id
-        self.settings = ServerSettings(serverID, config)
-
-        self.created_messages = set()
-        self.updating = False
-
-        self.compile()
-
-    def compile(self):
+        # this holds a dict called configuration which holds 8 keys
+        # "defined_streams", "defined_games", "blacklisted_streams", "whitelisted_games", "title_contains", "channel_id", "min_viewers", "max_results"
+        # the first 5 are ordered sets (dicts), channel_id is a single id and the last 2 are numbers (0 meaning no limit)
+        self.settings = ServerSettings(serverID, config, writer)
+
+        # maps user ids to rows of (message id, login, user id, fingerprint)
+        self.created_messages = {}
+        # what the store has for this server right now, so update() only writes the difference
+        self.saved_messages = {}
+        # held while the messages of the server are being updated or cleaned up
+        self.lock = asyncio.Lock()
+
+        # the parsed settings the polling loop uses, None means they need parsing again (see getFilter)
+        self.filter = None
+
+    async def storeCall(self, function, *args):
+        '''run a MessageStore call on the writer thread (or right here without a writer)'''
+        if self.writer is None:
+            return function(*args)
+        return await self.writer.run("messages", function, *args)
+
+    async def compile(self):
         ''' set up the main stuff.'''
-        for row in self.brainDB.getTable("messages"):
-            self.created_messages.add(row)
-
-    def verifyTables(self):
-        '''make sure all the tables exist.'''
-        if not self.brainDB.verifyTableExists("messages"):
-            self.brainDB.createTable("messages", ["message_id text", "streamer text", "user_id text"])
+        self.created_messages = await self.storeCall(self.store.getGuild, self.serverID)
+        self.saved_messages = dict(self.created_messages)
 
     def getStreamIDsFromMessages(self):
         '''return the list of user_ids from the message set'''
-        output = []
-        for x in self.created_messages:
-            output.append(x[2])
-        return output
-
-    def update(self):
-        '''update the db to match the set of messages'''
-        self.brainDB.emptyTable("messages")
-        if len(self.created_messages) > 0:
-            print(f"Saving DB for server {self.serverID}\n\t{' '.join([x[1] for x in self.created_messages])}")
-            self.brainDB.addRows("messages", list(self.created_messages))
+        return list(self.created_messages)
+
+    async def update(self):
+        '''update the db to match the set of messages
+        only the rows that changed since the last save are written, in a single commit, and nothing at all if none did'''
+        changed = [row for user_id, row in self.created_messages.items() if self.saved_messages.get(user_id) != row]
+        removed = [user_id for user_id in self.saved_messages if user_id not in self.created_messages]
+        if len(changed) == 0 and len(removed) == 0:
+            return
+        await self.storeCall(self.store.applyChanges, self.serverID, changed, removed)
+        self.saved_messages = dict(self.created_messages)
+
+    async def clearMessages(self):
+        '''forget every message of the server, returning the rows that were saved'''
+        self.created_messages = {}
+        self.saved_messages = {}
+        return await self.storeCall(self.store.emptyGuild, self.serverID)
 
     def toggleBlacklist(self, streamer):
         '''add or remove a user from the blacklist'''
@@ -824,45 +1503,106 @@ class LiveBrain:
     def setChannel(self, chan_id):
         '''set the channel id'''
         self.settings.modify("Config", "channel_id", str(chan_id))
+        self.filter = None
+        return True
+
+    def setStreamers(self, streamers):
+        '''replace the whole list of streamers'''
+        self.settings.modify("Config", "defined_streams", list(streamers))
+        self.filter = None
         return True
 
+    def setMinViewers(self, viewers):
+        '''set the viewers a stream from a category needs to be shown'''
+        self.settings.modify("Config", "min_viewers", str(viewers))
+        self.filter = None
+        return True
+
+    def setMaxResults(self, results):
+        '''set how many of the biggest streams from categories are shown'''
+        self.settings.modify("Config", "max_results", str(results))
+        self.filter = None
+        return True
+
+    def getFilter(self):
+        '''return the parsed settings, parsing them only if they changed'''
+        if self.filter is None:
+            self.filter = GuildFilter(self.settings)
+        return self.filter
+
     def __toggleConfigThing(self, place, item):
         '''something to shorten the above statements'''
-        things = self.settings.get("Config", place)
-        if item in things:
-            things.remove(item)
-            self.settings.modify("Config", place, "^^".join(things))
-            return False
-        things.append(item)
-        self.settings.modify("Config", place, "^^".join(things))
-        return True
+        self.filter = None
+        return self.settings.toggleItem("Config", place, item)
 
 
 
 class ServerSettings:
     # this is the object which describes each servers settings
-    # it parses a .ini file given by the server id and so forth
-    # the string list thing relies on splitting stuff by "^^" which IS SUCH A BAD IDEA OH MY GOD
-    
-    def __init__(self, serverID, config):
+    # they live in config/settings/<server id>.json, old .ini files are imported from the same folder the first time
+    # in memory the list settings are ordered sets (dicts of item -> None), everything else is a string
+    # changes only happen in memory, the file is written a moment later with everything changed since (see BB.settings)
+    # given a writer, that write happens on the writer thread (see BB.writer)
+
+    # the settings which hold lists, every other setting holds a single string
+    LIST_SETTINGS = ("blacklisted_streams", "whitelisted_games", "defined_streams", "defined_games", "title_contains")
+
+    def __init__(self, serverID, config, writer=None):
         self.serverID = str(serverID)
-        self.config_filepath = os.path.dirname(config.options)+"/settings/"+str(serverID)+".ini"
-        self.config = configparser.ConfigParser(interpolation=None)
-        if not self.config.read(self.config_filepath, encoding='utf-8'):
-            try:
-                os.makedirs(os.path.dirname(self.config_filepath), exist_ok=True)
-                shutil.copy(os.path.dirname(config.options)+"/example_server.ini", self.config_filepath)
-            except:
-                traceback.print_exc()
-                print("failure")
-    
-        self.config.read(self.config_filepath, encoding='utf-8')
+        self.folder = os.path.dirname(config.options)+"/settings/"
+        self.config_filepath = self.folder+str(serverID)+".json"
+        self.ini_filepath = self.folder+str(serverID)+".ini"
+        self.example_filepath = os.path.dirname(config.options)+"/example_server.ini"
+        self.file = SettingsFile(self.config_filepath, self.serialize, writer=writer)
+
+        self.sections = {}
+        loaded = self.file.load()
+        if loaded is not None:
+            for section, values in loaded.items():
+                self.sections[section] = {name: self.parse(name, value) for name, value in values.items()}
+        elif os.path.exists(self.ini_filepath):
+            self.import_ini(self.ini_filepath)
+        else:
+            self.sections = self.read_ini(self.example_filepath)
+            self.file.changed()
 
-        try:
-            self.configuration = self.config["Config"]         # Server Config
-        except:
+        if "Config" not in self.sections:
             print("I had to verify a server's settings: "+self.serverID)
             self.verify()
+        self.configuration = self.sections["Config"]         # Server Config
+
+    def parse(self, name, value):
+        '''turn a saved value into its in memory form: an ordered set for list settings, a string for the rest'''
+        if name in self.LIST_SETTINGS:
+            if isinstance(value, str):
+                value = value.split("^^")
+            return dict.fromkeys(x for x in value if x != '')
+        if isinstance(value, list):
+            return "^^".join(value)
+        return str(value)
+
+    def serialize(self):
+        '''return the settings as something json can save'''
+        return {section: {name: list(value) if isinstance(value, dict) else value for name, value in values.items()}
+            for section, values in self.sections.items()}
+
+    def read_ini(self, path):
+        '''read an old style .ini settings file, splitting the "^^" lists up'''
+        configurerer = configparser.ConfigParser(interpolation=None)
+        configurerer.read(path, encoding='utf-8')
+        return {section: {name: self.parse(name, value) for name, value in configurerer[section].items()}
+            for section in configurerer.sections()}
+
+    def import_ini(self, path):
+        '''take the settings from an old .ini file, save them as json and rename the .ini so it isnt imported again'''
+        self.sections = self.read_ini(path)
+        self.file.changed()
+        self.file.flush(wait=True) # written before the .ini goes away
+        try:
+            os.replace(path, path+".imported")
+        except:
+            traceback.print_exc()
+        print("Imported the old settings of server "+self.serverID)
 
     def verify(self):
         # to check back to the example ini and copy over missing settings in case of an update
@@ -870,46 +1610,29 @@ class ServerSettings:
         # this function should probably be run every time something is modified and on every bot restart per server
         # as well as on a server join
 
-        example_config_path = os.path.dirname(os.path.dirname(self.config_filepath))+"/example_server.ini"
-        configurerer = configparser.ConfigParser(interpolation=None)
-
-        configurerer.read(example_config_path, encoding='utf-8')
+        example = self.read_ini(self.example_filepath)["Config"]
 
         changes_made = 0
 
-        try:
-            for key, value in configurerer["Config"].items():
-                if key not in self.config["Config"]:
-                    self.config["Config"][key] = value
-                    changes_made += 1
-        except:
-            self.config["Config"] = configurerer["Config"]
-            print("Verify error: Missing config setting could not be defaulted, all server config settings reset.")
-            changes_made += len(configurerer["Config"])
-
-        try:
-            self.configuration
-        except:
-            self.configuration = configurerer["Config"]
-            self.config["Config"] = configurerer["Config"]
+        if "Config" not in self.sections:
+            self.sections["Config"] = example
             print("Verify error: Config does not exist on this server. Reset to default.")
-            changes_made += len(self.configuration)
-
-        if len(self.configuration) != len(configurerer["Config"]):
-            for key in configurerer["Config"]:
-                if key not in self.configuration:
-                    self.configuration[key] = configurerer["Config"][key]
-                    print("Set default config for missing: "+key)
-                    changes_made += 1
-            for key in self.configuration:
-                if key not in configurerer["Config"]:
-                    del self.configuration[key]
-                    print("Deleted deprecated config setting: "+key)
-                    changes_made += 1
-
-
-        with open(self.config_filepath, "w", encoding="utf-8") as file:
-            self.config.write(file)
+            changes_made += len(example)
+        self.configuration = self.sections["Config"]
+
+        for key in example:
+            if key not in self.configuration:
+                self.configuration[key] = example[key]
+                print("Set default config for missing: "+key)
+                changes_made += 1
+        for key in [x for x in self.configuration if x not in example]:
+            del self.configuration[key]
+            print("Deleted deprecated config setting: "+key)
+            changes_made += 1
+
+        # nothing is written unless something actually changed
+        if changes_made > 0:
+            self.file.changed()
         return changes_made
 
     def sanity_check(self, guild):
@@ -924,13 +1647,12 @@ class ServerSettings:
     def sanity_check_individual(self, section, name, guild):
         '''Check an individual setting, even if it is a list, for IDs that don't work'''
         try:
-            if self.config[section][name] == "0":
+            if self.sections[section][name] == "0":
                 return
-            potential_list = self.config[section][name].split("^^")
-            length = len(potential_list)
+            potential_list = self.get(section, name)
             for id in potential_list:
                 if self.isNone(id, guild):
-                    if length > 1:
+                    if name in self.LIST_SETTINGS:
                         self.remove(section, name, id)
                     else:
                         self.modify(section, name, "0")
@@ -962,10 +1684,7 @@ class ServerSettings:
 
     def get_default(self, section, name):
         '''Find the default value for a setting'''
-        configurerer = configparser.ConfigParser(interpolation=None)
-        example_config_path = os.path.dirname(os.path.dirname(self.config_filepath))+"/example_server.ini"
-        configurerer.read(example_config_path, encoding="utf-8")
-        return configurerer[section][name]
+        return self.read_ini(self.example_filepath)[section][name]
 
     def num_to_bool(self, section, name, truefalse="on off"):
         '''Return a conversion of 1 or 0 to True or False, basically.
@@ -974,9 +1693,9 @@ class ServerSettings:
         This will return None if something goes wrong.'''
         cases = truefalse.split()
         try:
-            if self.config[section][name] == "1":
+            if self.sections[section][name] == "1":
                 return cases[0]
-            elif self.config[section][name] == "0":
+            elif self.sections[section][name] == "0":
                 return cases[1]
             else:
                 return None
@@ -1000,65 +1719,42 @@ class ServerSettings:
 
 
     def add(self, section, name, value):
-        '''Add a setting to a section in the server setting ini
+        '''Add a setting to a section in the server settings
         Section is the [section]
         name is the name of the setting
         value is what to set the setting to
         Returns false if an error occurs'''
         try:
-            self.config[section][name] = value
-            with open(self.config_filepath, "w", encoding="utf-8") as file:
-                self.config.write(file)
+            self.sections.setdefault(section, {})[name] = self.parse(name, value)
+            self.file.changed()
             return True
         except:
             return False
 
     def remove(self, section, name, value=None):
-        '''Remove a setting to a section in the server setting ini
+        '''Remove a setting to a section in the server settings
         ... same as add but reversed and doesnt need a value
         If a value is given, it removes it from the list (assuming it should be a list)'''
         if value: #this is for removing an element from a list
             try:
-                if len(self.config[section][name].split("^^")) == 1:
-                    del self.config[section][name]
-                    with open(self.config_filepath, "w", encoding="utf-8") as file:
-                        self.config.write(file)
-                    return True
-                tmpSet = set(self.config[section][name].split("^^"))
-                tmpSet.remove(value)
-                self.config[section][name] = "^^".join(tmpSet)
-                with open(self.config_filepath, "w", encoding="utf-8") as file:
-                    self.config.write(file)
+                del self.sections[section][name][value]
+                self.file.changed()
                 return True
             except:
                 return False
         try:
-            del self.config[section][name]
-            with open(self.config_filepath, "w", encoding="utf-8") as file:
-                self.config.write(file)
+            del self.sections[section][name]
+            self.file.changed()
             return True
         except:
             return False
 
     def modify(self, section, name, value):
         ''' change a setting
-        if its a setting that holds a list, make sure its the right kind of value'''
+        list settings take a list (or the old "^^" joined string)'''
         try:
-            checks = set()
-            if name in checks:
-                to_remove = []
-                for x in value.split("^^"):
-                    try:
-                        int(x)
-                    except:
-                        to_remove.append(x)
-                valuelist = value.split("^^")
-                for x in to_remove:
-                    valuelist.remove(x)
-                value = "^^".join(valuelist)
-            self.config[section][name] = value
-            with open(self.config_filepath, "w", encoding="utf-8") as file:
-                self.config.write(file)
+            self.sections[section][name] = self.parse(name, value)
+            self.file.changed()
             return True
         except:
             traceback.print_exc()
@@ -1068,26 +1764,38 @@ class ServerSettings:
         '''Basically modify, except toggles a 1 to a 0 and a 0 to a 1
         Returns what we toggled to unless it didnt work'''
         try:
-            if self.config[section][name] == '0':
-                self.config[section][name] = "1"
-                with open(self.config_filepath, "w", encoding="utf-8") as file:
-                    self.config.write(file)
+            if self.sections[section][name] == '0':
+                self.sections[section][name] = "1"
+                self.file.changed()
                 return 1
-            elif self.config[section][name] == "1":
-                self.config[section][name] = "0"
-                with open(self.config_filepath, "w", encoding="utf-8") as file:
-                    self.config.write(file)
+            elif self.sections[section][name] == "1":
+                self.sections[section][name] = "0"
+                self.file.changed()
                 return 0
             return None
         except:
             return None
 
+    def toggleItem(self, section, name, item):
+        '''add an item to a list setting, or remove it if its already there
+        returns True if it was added and False if it was removed'''
+        things = self.sections[section][name]
+        added = item not in things
+        if added:
+            things[item] = None
+        else:
+            del things[item]
+        # after the change, changed() writes right away when no loop is running
+        self.file.changed()
+        return added
+
     def get(self, section, name):
         '''return the right thing for the right reasons'''
         try:
-            output = self.config[section][name].split("^^")
-            realout = [x for x in output if x != '']
-            return realout
+            value = self.sections[section][name]
+            if isinstance(value, dict):
+                return list(value)
+            return [x for x in value.split("^^") if x != '']
         except:
             traceback.print_exc()
-            return None
\ No newline at end of file
+            return None
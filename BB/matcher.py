@@ -0,0 +1,247 @@
+import heapq
+
+from collections import deque
+
+
+class PhraseAutomaton:
+    '''
+    An Aho-Corasick automaton built from the required title phrases of every guild at once.
+    Scanning a title walks it one character at a time and gives back every guild with a phrase in it,
+    instead of checking every phrase of every guild against every title.
+    Only needs rebuilding when someone changes their phrases.
+    '''
+    def __init__(self, phrases):
+        '''phrases maps each phrase to the set of guild ids requiring it'''
+        self.goto = [{}]        # state -> {character: next state}
+        self.fail = [0]         # state -> state to fall back to when the next character doesnt continue it
+        self.out = [set()]      # state -> guild ids with a phrase ending here (including through fail links)
+        for phrase, guilds in phrases.items():
+            state = 0
+            for ch in phrase:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(set())
+                    self.goto[state][ch] = nxt
+                state = nxt
+            self.out[state] |= set(guilds)
+        # breadth first so a state's fail link is always finished before its children need it
+        queue = deque(self.goto[0].values())
+        while len(queue) > 0:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                fallback = self.fail[state]
+                while fallback != 0 and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[nxt] = self.goto[fallback].get(ch, 0)
+                self.out[nxt] |= self.out[self.fail[nxt]]
+
+    def search(self, text):
+        '''return the set of guild ids with at least one phrase somewhere in the text'''
+        goto = self.goto
+        fail = self.fail
+        out = self.out
+        found = set(out[0])
+        state = 0
+        for ch in text:
+            while state != 0 and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state]:
+                found |= out[state]
+        return found
+
+
+class GuildFilter:
+    '''
+    The settings of one guild, parsed once into the shapes the polling loop wants.
+    LiveBrain keeps one of these and throws it away whenever the settings change,
+    so the loop never reads the settings themselves. Dont modify one, make a new one.
+    '''
+    __slots__ = ("channel_id", "defined_games", "defined_streams", "blacklist", "whitelist", "title_contains",
+        "min_viewers", "max_results")
+
+    def __init__(self, settings):
+        try:
+            self.channel_id = int(settings.configuration["channel_id"])
+        except:
+            self.channel_id = None
+        self.defined_games = tuple(settings.get("Config", "defined_games"))                       # kept in order, exact case
+        self.defined_streams = tuple(x.lower() for x in settings.get("Config", "defined_streams")) # kept in order
+        self.blacklist = frozenset(x.lower() for x in settings.get("Config", "blacklisted_streams"))
+        self.whitelist = frozenset(settings.get("Config", "whitelisted_games"))
+        self.title_contains = frozenset(settings.get("Config", "title_contains"))
+        # these only limit the streams found through categories, 0 means no limit
+        self.min_viewers = self.read_int(settings, "min_viewers")
+        self.max_results = self.read_int(settings, "max_results")
+
+    @staticmethod
+    def read_int(settings, name):
+        try:
+            return max(0, int(settings.configuration[name]))
+        except:
+            return 0
+
+
+class StreamMatcher:
+    '''
+    Figures out which guilds want which live streams.
+    Instead of checking every stream against every category of every guild, the guilds are indexed by
+    the game ids and the logins they watch. Each stream then only looks at the guilds that asked for it,
+    so the cost grows with the number of matches and not with guilds x streams.
+    Required title phrases are checked with a PhraseAutomaton, so each title is scanned once for all guilds.
+    Usage, once per loop:
+        matcher = StreamMatcher(game_map, phrase_automaton)
+        for every guild: matcher.add_guild(...)
+        output = matcher.match(dict_o_streams)
+    '''
+    def __init__(self, game_map, phrases=None):
+        self.game_map = game_map    # game id -> game name
+        self.phrases = phrases      # PhraseAutomaton of every guilds title_contains, built from the added guilds if None
+        self.ids_by_name = {}       # game name -> list of game ids with that name
+        for game_id, name in game_map.items():
+            self.ids_by_name.setdefault(name, []).append(game_id)
+        self.by_game = {}           # game id -> list of (guild id, position in defined_games)
+        self.by_login = {}          # login -> list of (guild id, position in defined_streams)
+        self.filters = {}           # guild id -> GuildFilter
+
+    def add_guild(self, guild_id, guild_filter):
+        '''index the categories and streamers a guild watches'''
+        self.filters[guild_id] = guild_filter
+        whites = guild_filter.whitelist
+        for position, category in enumerate(guild_filter.defined_games):
+            if len(whites) > 0 and category not in whites: continue # skip non whitelisted categories if applicable
+            for game_id in self.ids_by_name.get(category, []):
+                self.by_game.setdefault(game_id, []).append((guild_id, position))
+        for position, streamer in enumerate(guild_filter.defined_streams):
+            self.by_login.setdefault(streamer, []).append((guild_id, position))
+
+    def match(self, dict_o_streams):
+        '''dict_o_streams maps logins to tuples of (userinfo, streaminfo)
+        returns a dict mapping guild ids to dicts, mapping streamer names to tuples of (userinfo, streaminfo)
+        streams are ordered like they always were: by category first, then by watched streamer
+        streams found through categories are held to the guilds min_viewers, and only its top max_results by viewers are kept'''
+        if self.phrases is None:
+            phrases = {}
+            for guild_id, guild_filter in self.filters.items():
+                for phrase in guild_filter.title_contains:
+                    phrases.setdefault(phrase, set()).add(guild_id)
+            self.phrases = PhraseAutomaton(phrases)
+        by_game_hits = {guild_id: [] for guild_id in self.filters} # a min heap by viewers for guilds with max_results
+        by_login_hits = {guild_id: [] for guild_id in self.filters}
+        for stream_position, (login, stream_tuple) in enumerate(dict_o_streams.items()):
+            stream = stream_tuple[1]
+            title = stream.title.lower() if stream.title is not None else None
+            phrase_guilds = None # the guilds whose phrases are in the title, only scanned if someone needs it
+            # game_id sometimes is empty???
+            game_id = stream.game_id
+            viewers = stream.viewer_count
+            if game_id is not None:
+                for guild_id, position in self.by_game.get(game_id, []):
+                    guild_filter = self.filters[guild_id]
+                    blacks, title_contains = guild_filter.blacklist, guild_filter.title_contains
+                    if login in blacks: continue
+                    if viewers < guild_filter.min_viewers: continue
+                    # skip streams not containing the required phrases if applicable
+                    if len(title_contains) > 0:
+                        if title is None: continue
+                        if phrase_guilds is None:
+                            phrase_guilds = self.phrases.search(title)
+                        if guild_id not in phrase_guilds: continue
+                    if guild_filter.max_results > 0:
+                        # only keep the guilds top max_results by viewers, earlier streams win ties
+                        hits = by_game_hits[guild_id]
+                        entry = (viewers, -stream_position, position, login)
+                        if len(hits) < guild_filter.max_results:
+                            heapq.heappush(hits, entry)
+                        elif entry > hits[0]:
+                            heapq.heapreplace(hits, entry)
+                    else:
+                        by_game_hits[guild_id].append((position, stream_position, login))
+            for guild_id, position in self.by_login.get(login, []):
+                guild_filter = self.filters[guild_id]
+                blacks, whites, title_contains = guild_filter.blacklist, guild_filter.whitelist, guild_filter.title_contains
+                if login in blacks: continue
+                # skip streams not containing the required phrases if applicable
+                if len(title_contains) > 0:
+                    if title is None: continue
+                    if phrase_guilds is None:
+                        phrase_guilds = self.phrases.search(title)
+                    if guild_id not in phrase_guilds: continue
+                if len(whites) > 0 and game_id is not None:
+                    # skip non whitelisted categories if applicable
+                    game_name = self.game_map.get(game_id, None)
+                    if game_name is not None and game_name.lower() not in whites: continue
+                by_login_hits[guild_id].append((position, login))
+        output = {}
+        for guild_id in self.filters:
+            guild_streams = {}
+            hits = by_game_hits[guild_id]
+            if self.filters[guild_id].max_results > 0:
+                hits = [(position, -negative_position, login) for _, negative_position, position, login in hits]
+            for _, _, login in sorted(hits):
+                if login not in guild_streams:
+                    guild_streams[login] = dict_o_streams[login]
+            for _, login in sorted(by_login_hits[guild_id]):
+                if login not in guild_streams:
+                    guild_streams[login] = dict_o_streams[login]
+            output[guild_id] = guild_streams
+        return output
+
+
+class CrawlLimits:
+    '''
+    Tells a category crawl when paging further cant change what any guild gets anymore.
+    Helix sorts the streams of a request by viewers, highest first, and a chunk of games is one request,
+    so the lowest viewer count on the last page of a chunk is as high as any stream still to come in any of its games can go,
+    even for games that havent shown up on a page yet. Once that is below the min_viewers of every guild watching
+    the game, or those guilds already have max_results streams with at least that many viewers, the game is done.
+    A chunk of games only keeps paging while one of its games isnt done.
+    Guilds without either limit never let their games be done, so those get crawled completely like always.
+    '''
+    def __init__(self, matcher):
+        self.matcher = matcher
+        self.floor = {}     # game id -> the highest viewer count any of its streams still to come can have
+        # guild id -> min heap of the viewer counts of its best category streams so far, for guilds with max_results
+        self.top = {guild_id: [] for guild_id, guild_filter in matcher.filters.items() if guild_filter.max_results > 0}
+
+    def add_page(self, page, routed):
+        '''take in a page of streams and what the matcher gave every guild from it
+        page maps logins to (userinfo, streaminfo), routed is what StreamMatcher.match returned for it'''
+        for login, stream_tuple in page.items():
+            stream = stream_tuple[1]
+            game_id = stream.game_id
+            if game_id is None: continue
+            viewers = stream.viewer_count
+            for guild_id, _ in self.matcher.by_game.get(game_id, []):
+                heap = self.top.get(guild_id)
+                if heap is None or login not in routed.get(guild_id, {}): continue
+                if len(heap) < self.matcher.filters[guild_id].max_results:
+                    heapq.heappush(heap, viewers)
+                elif viewers > heap[0]:
+                    heapq.heapreplace(heap, viewers)
+
+    def done(self, game_id):
+        '''return True if no stream still to come in the game could change what any guild gets'''
+        floor = self.floor.get(game_id)
+        if floor is None:
+            return False
+        for guild_id, _ in self.matcher.by_game.get(game_id, []):
+            guild_filter = self.matcher.filters[guild_id]
+            if floor < guild_filter.min_viewers: continue
+            heap = self.top.get(guild_id)
+            if heap is not None and len(heap) >= guild_filter.max_results and heap[0] >= floor: continue
+            return False
+        return True
+
+    def more(self, game_ids, page):
+        '''return True if a chunk of game ids should keep paging
+        page is the page of streams the chunk just got, before anyone else has looked at it'''
+        if len(page) > 0:
+            lowest = min(stream.viewer_count for stream in page)
+            for game_id in game_ids:
+                self.floor[game_id] = min(self.floor.get(game_id, lowest), lowest)
+        return not all(self.done(game_id) for game_id in game_ids)
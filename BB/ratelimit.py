@@ -0,0 +1,73 @@
+import time
+import asyncio
+
+
+class TokenBucket:
+    '''
+    A client side copy of the Twitch Helix rate limit bucket.
+    Every Helix response carries these headers:
+        Ratelimit-Limit     - the size of the bucket
+        Ratelimit-Remaining - tokens left right now
+        Ratelimit-Reset     - unix timestamp when the bucket is full again
+    We keep our own count from them so requests wait before they are sent instead of after a 429.
+    One of these is shared by every Helix request the bot makes.
+    '''
+    def __init__(self, limit=800, low_water=0.1):
+        self.limit = limit
+        self.remaining = limit
+        self.reset = 0.0
+        self.in_flight = 0
+        # below this fraction of the bucket, the remaining tokens get spread out until the reset
+        self.low_water = low_water
+        self.lock = asyncio.Lock()
+
+    def wait_time(self, now=None):
+        '''how long the next request has to wait before it may be sent'''
+        if now is None:
+            now = time.time()
+        if now >= self.reset:
+            return 0
+        if self.remaining <= 0:
+            return self.reset - now
+        if self.remaining < self.limit * self.low_water:
+            return (self.reset - now) / self.remaining
+        return 0
+
+    async def acquire(self):
+        '''take a token, sleeping until one is available
+        requests queue up on the lock so they are let through in order'''
+        async with self.lock:
+            wait = self.wait_time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if time.time() >= self.reset:
+                # the window passed, so the bucket is full again
+                self.remaining = self.limit
+            self.remaining -= 1
+            self.in_flight += 1
+
+    def release(self, headers=None):
+        '''give back the in flight slot and sync the bucket to the response headers (if there are any)'''
+        self.in_flight = max(0, self.in_flight - 1)
+        if headers is None:
+            return
+        try:
+            limit = int(headers["Ratelimit-Limit"])
+            remaining = int(headers["Ratelimit-Remaining"])
+            reset = float(headers["Ratelimit-Reset"])
+        except (KeyError, ValueError):
+            return
+        self.limit = limit
+        # requests still in flight already took a token that twitch has not counted yet
+        remaining -= self.in_flight
+        if reset > self.reset:
+            self.reset = reset
+            self.remaining = remaining
+        else:
+            self.remaining = min(self.remaining, remaining)
+
+    def exhaust(self):
+        '''we got a 429, so there is nothing left until the reset no matter what we thought'''
+        self.remaining = 0
+        # twitch always sends the reset header, but dont spin on 429s if it somehow didnt
+        self.reset = max(self.reset, time.time() + 1)
@@ -0,0 +1,62 @@
+from sys import intern
+
+
+class StreamRecord:
+    '''
+    A live stream, holding only the fields of the helix stream json that matching and the embeds use.
+    Category crawls can hold a lot of these at once, so theres no __dict__, and the login and game id strings
+    are interned (the same game id is shared by every stream in the category).
+    title is None if twitch left it out, game_id is None if there isnt one.
+    '''
+    __slots__ = ("user_id", "login", "user_name", "game_id", "title", "viewer_count", "thumbnail_url")
+
+    def __init__(self, user_id, login, user_name, game_id, title, viewer_count, thumbnail_url):
+        self.user_id = user_id
+        self.login = login
+        self.user_name = user_name
+        self.game_id = game_id
+        self.title = title
+        self.viewer_count = viewer_count
+        self.thumbnail_url = thumbnail_url
+
+    @classmethod
+    def from_json(cls, data):
+        '''make one out of an entry of the "data" list of the helix streams endpoint'''
+        login = data.get("user_login")
+        game_id = data.get("game_id")
+        return cls(
+            data["user_id"],
+            intern(login) if login else None,
+            data.get("user_name", ""),
+            intern(game_id) if game_id is not None else None,
+            data.get("title"),
+            data.get("viewer_count", 0),
+            data.get("thumbnail_url", ""),
+        )
+
+
+class UserRecord:
+    '''
+    A twitch user, holding only the fields of the helix users json that the embeds use.
+    '''
+    __slots__ = ("id", "login", "profile_image_url", "view_count", "broadcaster_type", "description")
+
+    def __init__(self, id, login, profile_image_url, view_count, broadcaster_type, description):
+        self.id = id
+        self.login = login
+        self.profile_image_url = profile_image_url
+        self.view_count = view_count
+        self.broadcaster_type = broadcaster_type
+        self.description = description
+
+    @classmethod
+    def from_json(cls, data):
+        '''make one out of an entry of the "data" list of the helix users endpoint'''
+        return cls(
+            data["id"],
+            intern(data["login"]),
+            data.get("profile_image_url", ""),
+            data.get("view_count", 0),
+            data.get("broadcaster_type", ""),
+            data.get("description", ""),
+        )
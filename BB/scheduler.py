@@ -0,0 +1,62 @@
+import time
+
+
+class PollScheduler:
+    '''
+    Decides when the polling loop runs and what each cycle asks Twitch for.
+    Every workload has its own interval in seconds, for example:
+        watched     - the logins guilds watch by name, polled every cycle (this is the cycle interval)
+        categories  - the full crawl of every watched category
+        userinfo    - the profile info of live streamers (new streamers are fetched whenever they show up)
+        token       - validating the oauth token
+    Only one cycle runs at a time, and the time a cycle took comes off the wait before the next one,
+    so cycles start every `watched` seconds, or right after the previous one if it took longer than that.
+    A workload is due on the first cycle starting within half a cycle of its interval being up,
+    so the slower workloads dont slip a whole cycle late every time.
+    '''
+    def __init__(self, intervals, cycle="watched"):
+        self.intervals = dict(intervals)    # workload -> seconds between runs
+        self.cycle = cycle                  # the workload whose interval paces the cycles
+        self.last = {}                      # workload -> when it last ran
+        self.cycle_started = None
+
+    def wait_time(self, now=None):
+        '''return how long to sleep before starting the next cycle'''
+        if now is None:
+            now = time.time()
+        if self.cycle_started is None:
+            return self.intervals[self.cycle]
+        return max(0, self.intervals[self.cycle] - (now - self.cycle_started))
+
+    def start_cycle(self, now=None):
+        '''note the start of a cycle, the wait for the next one counts from here'''
+        if now is None:
+            now = time.time()
+        self.cycle_started = now
+        self.last[self.cycle] = now
+
+    def due(self, workload, now=None):
+        '''return True if the workload should run in the current cycle'''
+        if now is None:
+            now = time.time()
+        last = self.last.get(workload)
+        if last is None:
+            return True
+        return now - last >= self.intervals[workload] - self.intervals[self.cycle] / 2
+
+    def ran(self, workload, when=None):
+        '''note that a workload ran, when is the time it started'''
+        if when is None:
+            when = time.time()
+        self.last[workload] = when
+
+    def stats(self, now=None):
+        '''return a short description of when everything last ran'''
+        if now is None:
+            now = time.time()
+        lines = []
+        for workload, interval in self.intervals.items():
+            last = self.last.get(workload)
+            ago = "never" if last is None else f"{now - last:.0f}s ago"
+            lines.append(f"{workload}: every {interval}s, last ran {ago}")
+        return "\n".join(lines)
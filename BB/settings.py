@@ -0,0 +1,101 @@
+import os
+import json
+import atexit
+import asyncio
+import threading
+import traceback
+
+
+# every SettingsFile with changes that havent been written yet
+pending = set()
+
+
+def flush_all():
+    '''write out every settings file that is still waiting to be written'''
+    for settings_file in list(pending):
+        settings_file.flush(wait=True)
+
+
+# so changes made right before the bot stops arent lost
+atexit.register(flush_all)
+
+
+class SettingsFile:
+    '''
+    A json file that is written a moment after it is changed instead of on every change.
+    Everything changed in the meantime goes out in that one write, so a command changing 20 settings writes once.
+    The write goes to a temporary file which then replaces the real one, so the file is never left half written.
+    serialize is a function taking nothing and returning what to save.
+    With a writer (see BB.writer.DBWriter) the file is written on the writer thread instead of the event loop.
+    '''
+    def __init__(self, path, serialize, delay=2, writer=None):
+        self.path = path
+        self.serialize = serialize
+        self.delay = delay          # seconds between the first change and the write
+        self.writer = writer
+        self.handle = None          # the scheduled write, if there is one
+        self.version = 0            # counts the flushes, so an older write never replaces a newer one
+        self.written = 0            # the version in the file right now
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def load(self):
+        '''return what is saved in the file, or None if there is no file (or it is broken)'''
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except:
+            traceback.print_exc()
+            print("Could not read "+self.path)
+            return None
+
+    def changed(self):
+        '''note that something changed, the file is written a moment later
+        if there is no event loop running the file is written right away'''
+        pending.add(self)
+        if self.handle is not None:
+            return
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            loop = None
+        if loop is None or not loop.is_running():
+            return self.flush(wait=True)
+        self.handle = loop.call_later(self.delay, self.flush)
+
+    def flush(self, wait=False):
+        '''write the file if anything changed
+        the data is taken right now, but unless wait is True the writing itself happens on the writer thread'''
+        if self.handle is not None:
+            self.handle.cancel()
+            self.handle = None
+        if self not in pending:
+            return
+        pending.discard(self)
+        self.version += 1
+        data = self.serialize()
+        if self.writer is not None and not wait:
+            self.writer.submit("settings", self.write, data, self.version)
+        else:
+            self.write(data, self.version)
+
+    def write(self, data, version):
+        '''actually write the file, on whichever thread calls this'''
+        with self.lock:
+            if version <= self.written:
+                return # something newer already went out
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temp_path = self.path+".tmp"
+                with open(temp_path, "w", encoding="utf-8") as file:
+                    json.dump(data, file, indent=4)
+                    file.flush()
+                    os.fsync(file.fileno())
+                os.replace(temp_path, self.path)
+                self.written = version
+                self.writes += 1
+            except:
+                traceback.print_exc()
+                print("Could not write "+self.path)
@@ -0,0 +1,60 @@
+import time
+import asyncio
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DBWriter:
+    '''
+    Runs database work and settings file writes on one dedicated thread, so the event loop never waits on the disk.
+    There is only the one thread, so jobs run in exactly the order they were submitted:
+    the writes of a guild never overtake each other, and each sqlite connection is only ever used by one thread at a time.
+    Usage:
+        rows = await writer.run("messages", store.getGuild, guild_id)   # wait for the result
+        writer.submit("settings", settings_file.write, data, version)   # dont wait at all
+    The label only groups the timing stats.
+    '''
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self.lock = threading.Lock()    # guards the stats, which are written on the writer thread
+        self.timings = {}               # label -> [jobs, seconds running, longest run, seconds waiting in the queue]
+        self.queued = 0                 # jobs submitted but not finished
+
+    def submit(self, label, function, *args):
+        '''queue a job and return the concurrent future of it right away'''
+        with self.lock:
+            self.queued += 1
+        return self.executor.submit(self.timed, label, time.perf_counter(), function, args)
+
+    def run(self, label, function, *args):
+        '''queue a job and return an awaitable for its result (errors are raised by the await)'''
+        return asyncio.wrap_future(self.submit(label, function, *args))
+
+    def timed(self, label, submitted, function, args):
+        '''runs on the writer thread. does the job and writes down how long it waited and took'''
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            end = time.perf_counter()
+            with self.lock:
+                self.queued -= 1
+                timing = self.timings.setdefault(label, [0, 0.0, 0.0, 0.0])
+                timing[0] += 1
+                timing[1] += end - start
+                timing[2] = max(timing[2], end - start)
+                timing[3] += start - submitted
+
+    def stats(self):
+        '''return a short description of how long the database work has been taking'''
+        with self.lock:
+            lines = [f"{self.queued} jobs queued"]
+            for label, (jobs, running, longest, waiting) in sorted(self.timings.items()):
+                lines.append(f"{label}: {jobs} jobs, {running * 1000 / jobs:.2f}ms average, "
+                    f"{longest * 1000:.2f}ms longest, {waiting * 1000 / jobs:.2f}ms average wait")
+        return "\n".join(lines)
+
+    def close(self):
+        '''wait for every queued job to finish and stop the thread'''
+        self.executor.shutdown(wait=True)